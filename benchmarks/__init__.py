@@ -0,0 +1 @@
+"""Benchmarks of the bot's helpers, run from the repository root with e.g. ``python -m benchmarks.clients``."""
@@ -0,0 +1,295 @@
+"""Benchmarks the helper clients, ``get_code`` and ``send_output`` against the synthetic stand-ins.
+
+Run it from the repository root with ``python -m benchmarks.clients``. The stand-ins are started in a
+subprocess unless ``--url`` points at running ones, so that their work isn't measured. Results are
+printed as JSON, with throughput and latencies of successful operations per scenario, and the peak RSS
+of the whole run. Scenarios share one process, so run them one at a time with ``--scenarios`` to compare
+their memory use.
+
+Execution requests go through the same scheduler limits as in the bot, so those bound the throughput.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import datetime
+import functools
+import json
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+import types
+
+import aiohttp
+
+from benchmarks.standins import StandinConfig
+from rustpy.constants import EXECUTION_CONCURRENCY, URLs
+from rustpy.helpers import MystBinClient, PasteService, PistonClient, PistonFile, RustPlaygroundClient, TIOClient
+from rustpy.helpers.batch import gather_bounded
+from rustpy.helpers.common import Output, get_code, send_output
+from rustpy.helpers.http import UpstreamHTTP
+from rustpy.helpers.offload import Offloader
+from rustpy.helpers.scheduler import ExecutionScheduler
+
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+Scenario = Callable[['BenchBot', int], Awaitable[Any]]
+
+
+class BenchBot:
+    """The parts of :class:`rustpy.RustPy` which the clients use, without connecting to Discord."""
+
+    def __init__(self, session: aiohttp.ClientSession, *, base_url: str, rate_limit: float, source_size: int) -> None:
+        self.session: aiohttp.ClientSession = session
+        self.upstream: UpstreamHTTP = UpstreamHTTP(session, default_rate_limit=(rate_limit, max(int(rate_limit), 1)))
+        self.scheduler: ExecutionScheduler = ExecutionScheduler(EXECUTION_CONCURRENCY, max_queued=1_000_000)
+        self.offload: Offloader = Offloader()
+
+        self.mystbin: MystBinClient = MystBinClient(bot=self)
+        self.pastes: PasteService = PasteService([self.mystbin])
+        self.piston: PistonClient = PistonClient(bot=self, urls=[base_url + '/piston/'])
+        self.rust: RustPlaygroundClient = RustPlaygroundClient(bot=self)
+        self.tio: TIOClient = TIOClient(bot=self)
+
+        self.source: bytes = (b'print("Hello, world!")  # Some padding to make the line longer\n' * source_size)[:source_size]
+
+    async def warm(self) -> None:
+        await asyncio.gather(self.piston.catalog.get(), self.tio.catalog.get())
+
+    def close(self) -> None:
+        self.offload.close()
+
+
+class BenchAttachment:
+    def __init__(self, data: bytes) -> None:
+        self.data: bytes = data
+        self.size: int = len(data)
+
+    async def read(self) -> bytes:
+        return self.data
+
+
+class BenchContext:
+    """The parts of :class:`rustpy.core.Context` which ``get_code`` and ``send_output`` use."""
+
+    def __init__(self, bot: BenchBot, *, attachments: list[BenchAttachment] = ()) -> None:
+        self.bot: BenchBot = bot
+        self.message: types.SimpleNamespace = types.SimpleNamespace(attachments=list(attachments), reference=None)
+
+    @contextlib.contextmanager
+    def phase(self, _: str) -> Iterator[None]:
+        yield
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> types.SimpleNamespace:
+        return types.SimpleNamespace(content=content, **kwargs)
+
+
+# Every operation uses a different program or content, so that caches and request coalescing don't hide the work
+
+async def piston_execute(bot: BenchBot, i: int) -> None:
+    runtime = await bot.piston.get_runtime('python')
+    await bot.piston.execute(runtime, [PistonFile('main.py', f'print({i})')])
+
+
+async def tio_run(bot: BenchBot, i: int) -> None:
+    response = await bot.tio.run(f'print({i})', 'python3')
+    response.output
+
+
+async def rust_execute(bot: BenchBot, i: int) -> None:
+    await bot.rust.execute(f'fn main() {{\n    println!("{i}");\n}}\n')
+
+
+async def mystbin_get_paste(bot: BenchBot, i: int) -> None:
+    await bot.mystbin.get_paste(f'bench{i}')
+
+
+async def mystbin_create_paste(bot: BenchBot, i: int) -> None:
+    await bot.mystbin.create_paste(f'{i}\n' + bot.source.decode('utf-8'), syntax='py')
+
+
+async def get_code_attachment(bot: BenchBot, i: int) -> None:
+    await get_code(BenchContext(bot, attachments=[BenchAttachment(bot.source)]))
+
+
+async def send_output_long(bot: BenchBot, i: int) -> None:
+    await send_output(BenchContext(bot), Output(f'{i}\n', bot.source.decode('utf-8')), syntax='py')
+
+
+SCENARIOS: dict[str, Scenario] = {
+    'piston.execute': piston_execute,
+    'tio.run': tio_run,
+    'rust.execute': rust_execute,
+    'mystbin.get_paste': mystbin_get_paste,
+    'mystbin.create_paste': mystbin_create_paste,
+    'get_code': get_code_attachment,
+    'send_output': send_output_long,
+}
+
+
+def _peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+
+def _quantile(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def run_scenario(scenario: Scenario, bot: BenchBot, *, requests: int, concurrency: int) -> dict[str, Any]:
+    latencies = []
+    errors = collections.Counter()
+
+    async def operation(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            await scenario(bot, i)
+        except Exception as exc:
+            errors[type(exc).__name__] += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await gather_bounded((functools.partial(operation, i) for i in range(requests)), limit=concurrency)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': sum(errors.values()),
+        'error_types': dict(errors),
+        'seconds': elapsed,
+        'throughput': requests / elapsed,
+        'latency': {
+            'p50': _quantile(latencies, 0.5),
+            'p99': _quantile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def standins(config: StandinConfig, *, url: Optional[str]) -> AsyncIterator[str]:
+    """Starts the stand-ins in a subprocess unless ``url`` is given, yielding the URL they're served at."""
+    if url:
+        yield url.rstrip('/')
+        return
+
+    port = _free_port()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-m', 'benchmarks.standins', f'--port={port}', *config.to_arguments(),
+    )
+    url = f'http://127.0.0.1:{port}'
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            for _ in range(100):
+                with contextlib.suppress(aiohttp.ClientError):
+                    async with session.get(url + '/health') as response:
+                        if response.ok:
+                            break
+
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError('The stand-ins did not start in time.')
+
+        yield url
+    finally:
+        process.terminate()
+        await process.wait()
+
+
+def _point_urls(base: str) -> None:
+    URLs.TIO_RUN = base + '/tio/run'
+    URLs.TIO_LANGUAGES = base + '/tio/languages.json'
+    URLs.RUST_PLAYGROUND = base + '/rust/'
+    URLs.MYSTBIN = base + '/mystbin/api/pastes'
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    config = StandinConfig.from_arguments(args)
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+
+    if unknown := set(names) - SCENARIOS.keys():
+        raise SystemExit(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+    results = {}
+
+    async with standins(config, url=args.url) as url, aiohttp.ClientSession() as session:
+        _point_urls(url)
+
+        for name in names:
+            # A fresh bot per scenario, so that caches and circuit breakers don't carry over
+            bot = BenchBot(session, base_url=url, rate_limit=args.rate_limit, source_size=args.source_size)
+            try:
+                await bot.warm()
+                results[name] = await run_scenario(
+                    SCENARIOS[name], bot, requests=args.requests, concurrency=args.concurrency,
+                )
+            finally:
+                bot.close()
+
+            print(f'{name}: {results[name]["throughput"]:.1f}/s', file=sys.stderr)
+
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'rate_limit': args.rate_limit,
+            'source_size': args.source_size,
+            **config._asdict(),
+        },
+        'scenarios': results,
+        'peak_rss_bytes': _peak_rss(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='Operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='Operations in flight at once')
+    parser.add_argument('--scenarios', help=f'Comma separated, out of {", ".join(SCENARIOS)}')
+    parser.add_argument('--rate-limit', type=float, default=10_000.0, help='Requests per second to the stand-ins')
+    parser.add_argument('--source-size', type=int, default=100_000, help='Bytes of attachments and pastes')
+    parser.add_argument('--url', help='URL of stand-ins which are already running')
+    parser.add_argument('--output', default='-', help='File to write the results to, - for stdout')
+    StandinConfig.add_arguments(parser)
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+
+    if args.output == '-':
+        print(report)
+    else:
+        with open(args.output, 'w') as fp:
+            fp.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Compares detecting the crate type with the old ``fn main`` regex against :func:`rustpy.helpers.lexer.has_main`.
+
+Run it from the repository root with ``python -m benchmarks.crate_type``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import timeit
+
+from rustpy.helpers.lexer import has_main
+
+from typing import Callable
+
+# What RustPlaygroundClient used before the lexer
+LEGACY_REGEX: re.Pattern[str] = re.compile(r'fn\s+main\s*\([^)]*\)\s*(->\s*[^{]+\s*)?{.*\}', re.S)
+
+PROGRAM = '''\
+use std::collections::HashMap;
+
+/// Counts words, see `fn main() {}` below
+struct Counter<'a> {
+    counts: HashMap<&'a str, usize>,
+}
+
+impl<'a> Counter<'a> {
+    fn add(&mut self, text: &'a str) {
+        for word in text.split_whitespace() {
+            *self.counts.entry(word).or_default() += 1;
+        }
+    }
+}
+
+fn main() {
+    let mut counter = Counter { counts: HashMap::new() };
+    counter.add("the quick brown fox jumps over the lazy dog");
+    println!("{:?} {}", counter.counts, '}');
+}
+'''
+
+
+def _cases(size: int) -> dict[str, str]:
+    library = PROGRAM.replace('fn main()', 'fn run()')
+
+    return {
+        'program': PROGRAM,
+        'large program': library * (size // len(library)) + PROGRAM,
+        'large library': library * (size // len(library)),
+        # Every `fn main() {` makes the regex scan to the end of the source looking for a `}`
+        'unclosed mains': 'fn main() {\n' * (size // 12),
+    }
+
+
+def _time(func: Callable[[str], object], code: str, *, budget: float) -> float:
+    """Returns the seconds one call takes, repeating it for about ``budget`` seconds."""
+    timer = timeit.Timer(lambda: func(code))
+    number, elapsed = timer.autorange()
+
+    if elapsed < budget:
+        number = max(int(number * budget / elapsed), 1)
+        elapsed = min(timer.repeat(repeat=3, number=number))
+
+    return elapsed / number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100_000, help='Characters in the large cases')
+    parser.add_argument('--budget', type=float, default=0.5, help='Seconds to spend timing each case')
+    args = parser.parse_args()
+
+    print(f'{"case":<16}{"chars":>10}{"regex":>14}{"lexer":>14}{"speedup":>10}')
+
+    for name, code in _cases(args.size).items():
+        regex = _time(LEGACY_REGEX.search, code, budget=args.budget)
+        lexer = _time(has_main, code, budget=args.budget)
+
+        print(f'{name:<16}{len(code):>10}{regex * 1e6:>12.1f}us{lexer * 1e6:>12.1f}us{regex / lexer:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
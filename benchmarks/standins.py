@@ -0,0 +1,135 @@
+"""Synthetic stand-ins for Piston, TIO, the Rust playground and MystBin, for benchmarking the clients.
+
+Nothing is actually run. Every request to an execution or paste endpoint waits for the configured
+latency, fails with the configured probability and otherwise responds with output of the configured
+size, so that runs are repeatable and only measure the bot's side. Catalog endpoints never fail.
+
+Run it with ``python -m benchmarks.standins --port 2100``, or let ``benchmarks.clients`` start it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import random
+
+from aiohttp import web
+from typing import Awaitable, Callable, NamedTuple
+
+__all__ = (
+    'StandinConfig',
+    'create_app',
+)
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+TIO_TOKEN = '0123456789abcdef'
+
+PISTON_RUNTIMES = [
+    {'language': 'python', 'version': '3.10.0', 'aliases': ['py', 'py3', 'python3']},
+    {'language': 'javascript', 'version': '16.3.0', 'aliases': ['node-javascript', 'node-js', 'js']},
+]
+
+TIO_LANGUAGES = {name: {'name': name} for name in ('python3', 'python38pr', 'javascript-node', 'rust', 'bash')}
+
+
+class StandinConfig(NamedTuple):
+    latency: float = 0.05  # In seconds
+    jitter: float = 0.2  # Latencies are spread uniformly this fraction around the mean
+    error_rate: float = 0.0  # Share of requests answered with `error_status`
+    error_status: int = 500
+    output_size: int = 1024  # Bytes of program output, or of paste content
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument('--latency', type=float, default=cls._field_defaults['latency'])
+        parser.add_argument('--jitter', type=float, default=cls._field_defaults['jitter'])
+        parser.add_argument('--error-rate', type=float, default=cls._field_defaults['error_rate'])
+        parser.add_argument('--error-status', type=int, default=cls._field_defaults['error_status'])
+        parser.add_argument('--output-size', type=int, default=cls._field_defaults['output_size'])
+
+    @classmethod
+    def from_arguments(cls, args: argparse.Namespace) -> StandinConfig:
+        return cls(**{field: getattr(args, field) for field in cls._fields})
+
+    def to_arguments(self) -> list[str]:
+        return [f'--{field.replace("_", "-")}={value}' for field, value in self._asdict().items()]
+
+
+def _make_output(size: int) -> str:
+    line = 'The quick brown fox jumps over the lazy dog. 0123456789 abcdefghijk\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def create_app(config: StandinConfig = StandinConfig()) -> web.Application:
+    output = _make_output(config.output_size)
+    paste_ids = (f'bench{n:x}' for n in itertools.count())
+
+    def synthetic(handler: Handler) -> Handler:
+        async def wrapper(request: web.Request) -> web.StreamResponse:
+            await request.read()
+
+            spread = config.latency * config.jitter
+            await asyncio.sleep(max(config.latency + random.uniform(-spread, spread), 0.0))
+
+            if random.random() < config.error_rate:
+                return web.Response(status=config.error_status, text='Injected failure')
+
+            return await handler(request)
+
+        return wrapper
+
+    async def health(_: web.Request) -> web.Response:
+        return web.Response(text='OK')
+
+    async def piston_runtimes(_: web.Request) -> web.Response:
+        return web.json_response(PISTON_RUNTIMES)
+
+    async def piston_execute(request: web.Request) -> web.Response:
+        data = await request.json()
+        run = {'stdout': output, 'stderr': '', 'output': output, 'code': 0, 'signal': None}
+        return web.json_response({'language': data['language'], 'version': data['version'], 'run': run})
+
+    async def tio_languages(_: web.Request) -> web.Response:
+        return web.json_response(TIO_LANGUAGES)
+
+    async def tio_run(_: web.Request) -> web.Response:
+        debug = (
+            '\nReal time: 0.051 s\nUser time: 0.032 s\nSys. time: 0.011 s\nCPU share: 84.31 %\nExit code: 0'
+        )
+        return web.Response(text=TIO_TOKEN + output + '\n' + TIO_TOKEN + debug + TIO_TOKEN)
+
+    async def rust_execute(_: web.Request) -> web.Response:
+        return web.json_response({'success': True, 'stdout': output, 'stderr': ''})
+
+    async def mystbin_get(_: web.Request) -> web.Response:
+        return web.json_response({'data': output, 'syntax': 'py'})
+
+    async def mystbin_create(_: web.Request) -> web.Response:
+        return web.json_response({'pastes': [{'id': next(paste_ids)}]})
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_get('/health', health)
+    app.router.add_get('/piston/runtimes', piston_runtimes)
+    app.router.add_post('/piston/execute', synthetic(piston_execute))
+    app.router.add_get('/tio/languages.json', tio_languages)
+    app.router.add_post('/tio/run', synthetic(tio_run))
+    app.router.add_post('/rust/execute', synthetic(rust_execute))
+    app.router.add_get('/mystbin/api/pastes/{paste}', synthetic(mystbin_get))
+    app.router.add_post('/mystbin/api/pastes', synthetic(mystbin_create))
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2100)
+    StandinConfig.add_arguments(parser)
+    args = parser.parse_args()
+
+    web.run_app(create_app(StandinConfig.from_arguments(args)), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,15 @@
 from enum import Enum
 
 __all__ = (
+    'BATCH_CONCURRENCY',
     'DEFAULT_GROUP_KWARGS',
+    'EXECUTION_CONCURRENCY',
+    'EXECUTION_MAX_QUEUED',
+    'MAX_OUTPUT_SIZE',
+    'MAX_RESPONSE_SIZE',
+    'OFFLOAD_THRESHOLD',
+    'OFFLOAD_WORKERS',
+    'UPSTREAM_RATE_LIMITS',
     'URLs',
     'RustChannel',
     'RustEdition',
@@ -10,12 +18,43 @@ __all__ = (
 
 DEFAULT_GROUP_KWARGS = dict(case_insensitive=True, invoke_without_command=True)
 
+# Maximum amount of concurrent requests to each execution backend
+EXECUTION_CONCURRENCY = dict(piston=8, tio=4, rust=4)
+
+# Maximum amount of requests that may wait for a slot on each execution backend
+EXECUTION_MAX_QUEUED = 32
+
+# Maximum amount of jobs of a single batch which run at once
+BATCH_CONCURRENCY = 3
+
+# Most bytes of a program's output which are kept, anything past it is truncated
+MAX_OUTPUT_SIZE = 1_000_000
+
+# Most bytes of a JSON response from an execution backend which are read, anything larger is rejected
+MAX_RESPONSE_SIZE = 4_000_000
+
+# Bytes of input past which CPU heavy work like compression or decoding is moved off of the event loop
+OFFLOAD_THRESHOLD = 65_536
+
+# Threads which offloaded work runs on, few so that large submissions queue behind each other
+OFFLOAD_WORKERS = 2
+
+# Requests per second and burst size allowed to each upstream host
+UPSTREAM_RATE_LIMITS = {
+    'emkc.org': (5.0, 5),
+    'tio.run': (5.0, 10),
+    'play.rust-lang.org': (5.0, 10),
+    'mystb.in': (2.0, 5),
+    'paste.rs': (2.0, 5),
+}
+
 
 class URLs:
     TIO_RUN: str = "https://tio.run/cgi-bin/run/api/"
     TIO_LANGUAGES: str = "https://tio.run/languages.json"
     PISTON: str = "https://emkc.org/api/v2/piston/"
     MYSTBIN: str = "https://mystb.in/api/pastes"
+    PASTE_RS: str = "https://paste.rs/"
     RUST_PLAYGROUND: str = "https://play.rust-lang.org/"
 
 
@@ -1,17 +1,38 @@
+import asyncio
+import importlib
 import os
+import time
 
 import aiohttp
 import discord
 
+from aiohttp import web
+
 from dotenv import load_dotenv
 from discord.ext import commands
 from jishaku.flags import Flags
 
-from rustpy.core.database import Database
+from rustpy.constants import EXECUTION_CONCURRENCY, EXECUTION_MAX_QUEUED, UPSTREAM_RATE_LIMITS, URLs
+from rustpy.core.database import STATEMENTS, Database
+from rustpy.core.metrics import COMMAND_SECONDS, METRICS, serve_metrics
 from rustpy.core.models import Context
-from rustpy.helpers import MystBinClient, PistonClient, RustPlaygroundClient, TIOClient
+from rustpy.core.startup import StageFailed, StartupPipeline
+from rustpy.core.watchdog import LoopWatchdog
+from rustpy.helpers import (
+    MystBinClient,
+    PasteBackend,
+    PasteRsClient,
+    PasteService,
+    PistonClient,
+    RustPlaygroundClient,
+    TIOClient,
+)
+from rustpy.helpers.cache import CacheStats, ResultCache
+from rustpy.helpers.http import UpstreamHTTP
+from rustpy.helpers.offload import Offloader
+from rustpy.helpers.scheduler import ExecutionScheduler
 
-from typing import TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING
 
 load_dotenv()
 
@@ -27,6 +48,15 @@ INTENTS = discord.Intents(
     typing=True
 )
 
+# Port of the local HTTP server exporting metrics on /metrics, it isn't started if this is empty
+METRICS_PORT = os.environ.get('METRICS_PORT', '9108')
+
+# In seconds, the event loop being blocked for longer than this is logged along with where it was blocked
+LOOP_STALL_THRESHOLD = float(os.environ.get('LOOP_STALL_THRESHOLD', '0.1'))
+
+# Where snapshots of the Piston runtimes and TIO languages are kept, so that restarts work offline
+CATALOG_DIRECTORY = os.environ.get('CATALOG_DIR', '.cache/catalogs')
+
 ALLOWED_MENTIONS = discord.AllowedMentions(
     users=True,
     roles=False,
@@ -39,11 +69,23 @@ __all__ = (
 )
 
 
+def _env_list(name: str, default: str) -> list[str]:
+    """Returns the comma separated values of an environment variable, ignoring blank ones."""
+    return [value.strip() for value in os.environ.get(name, default).split(',') if value.strip()] or [default]
+
+
 class RustPy(commands.Bot):
     session: aiohttp.ClientSession
     db: Database
+    scheduler: ExecutionScheduler
+    startup: StartupPipeline
+    upstream: UpstreamHTTP
+    offload: Offloader
+    watchdog: LoopWatchdog
+    metrics_runner: Optional[web.AppRunner] = None
 
     mystbin: MystBinClient
+    pastes: PasteService
     piston: PistonClient
     rust: RustPlaygroundClient
     tio: TIOClient
@@ -67,36 +109,146 @@ class RustPy(commands.Bot):
     async def _get_prefix(self, message: discord.Message) -> str:
         return ['>>', 'rs!', 'rust!', 'rustpy ']  # Too lazy to make a decent prefix system so here you go
 
-    def load_extensions(self) -> None:
-        self.load_extension('jishaku')
+    async def load_extensions(self) -> None:
+        extensions = ['jishaku']
 
         for file in os.listdir('./rustpy/extensions'):
             if file.endswith('.py') and not file.startswith('_'):
-                self.load_extension(f'rustpy.extensions.{file[:-3]}')
+                extensions.append(f'rustpy.extensions.{file[:-3]}')
+
+        # Importing is the slow part, so do it off of the event loop
+        await asyncio.to_thread(lambda: [importlib.import_module(name) for name in extensions])
+
+        for name in extensions:
+            await discord.utils.maybe_coroutine(self.load_extension, name)
+
+    async def setup_http(self) -> None:
+        self.session = aiohttp.ClientSession()
+        self.upstream = UpstreamHTTP(self.session, rate_limits=UPSTREAM_RATE_LIMITS)
+        self.piston.pool.start(self.session)
+        self.piston.catalog.start()
+        self.tio.catalog.start()
 
     async def setup_database(self) -> None:
-        self.db = Database(loop=self.loop)
+        self.db = Database(loop=self.loop, write_behind=bool(os.environ.get('SETTINGS_WRITE_BEHIND')))
+        await self.db.wait_until_ready()
+
+    def _cache_stats(self) -> dict[str, CacheStats]:
+        stats = {
+            'rust_results': self.rust.cache.stats,
+            'rust_crate_types': self.rust.crate_types.stats,
+            'mystbin_pastes': self.mystbin.pastes.stats,
+            'mystbin_uploads': self.mystbin.uploads.stats,
+        }
+
+        if self.startup.is_ready('database'):
+            stats['settings'] = self.db.settings_cache.stats
+
+        return stats
+
+    def _register_metrics(self) -> None:
+        def cache_stat(attribute: str) -> dict[tuple[str, ...], float]:
+            return {(name,): getattr(stats, attribute) for name, stats in self._cache_stats().items()}
+
+        METRICS.collector(
+            'rustpy_cache_hits_total', 'Cache lookups which found an entry.', 'counter',
+            lambda: cache_stat('hits'), labels=('cache',),
+        )
+        METRICS.collector(
+            'rustpy_cache_misses_total', 'Cache lookups which found nothing.', 'counter',
+            lambda: cache_stat('misses'), labels=('cache',),
+        )
+        METRICS.collector(
+            'rustpy_cache_evictions_total', 'Cache entries evicted to make room for others.', 'counter',
+            lambda: cache_stat('evictions'), labels=('cache',),
+        )
+        METRICS.collector(
+            'rustpy_cache_hit_ratio', 'Share of cache lookups which found an entry.', 'gauge',
+            lambda: cache_stat('hit_rate'), labels=('cache',),
+        )
+        METRICS.collector(
+            'rustpy_scheduler_active', 'Execution requests currently running on each backend.', 'gauge',
+            lambda: {(name,): queue.active for name, queue in self.scheduler.queues.items()}, labels=('backend',),
+        )
+        METRICS.collector(
+            'rustpy_scheduler_queued', 'Execution requests currently waiting for a slot on each backend.', 'gauge',
+            lambda: {(name,): queue.queued for name, queue in self.scheduler.queues.items()}, labels=('backend',),
+        )
+        METRICS.collector(
+            'rustpy_database_statement_seconds', 'Time taken by prepared database statements.', 'histogram',
+            lambda: {(name,): histogram for name, histogram in STATEMENTS.latency.items()}, labels=('statement',),
+        )
+
+    async def setup_metrics(self) -> None:
+        self.watchdog.start()
+
+        if METRICS_PORT:
+            self.metrics_runner = await serve_metrics(port=int(METRICS_PORT))
+
+    async def warm_catalogs(self) -> None:
+        await asyncio.gather(self.piston.catalog.get(), self.tio.catalog.get())
+
+    def _paste_backends(self) -> list[PasteBackend]:
+        # Comma separated, in order of preference until their latencies are known.
+        # Anything which isn't a known service is taken as the URL of a paste.rs compatible stand-in.
+        backends = []
+
+        for name in _env_list('PASTE_BACKENDS', 'mystbin'):
+            if name == 'mystbin':
+                backends.append(self.mystbin)
+            elif name == 'paste.rs':
+                backends.append(PasteRsClient(bot=self))
+            else:
+                backends.append(PasteRsClient(bot=self, url=name, name='local paste'))
+
+        return backends
 
     def setup(self) -> None:
-        self.session = aiohttp.ClientSession()
+        self.scheduler = ExecutionScheduler(EXECUTION_CONCURRENCY, max_queued=EXECUTION_MAX_QUEUED)
+        self.offload = Offloader()
+
+        self.watchdog = LoopWatchdog(threshold=LOOP_STALL_THRESHOLD)
+        self._register_metrics()
 
         self.mystbin = MystBinClient(bot=self)
-        self.piston = PistonClient(bot=self)
-        self.rust = RustPlaygroundClient(bot=self)
-        self.tio = TIOClient(bot=self)
+        self.pastes = PasteService(self._paste_backends())
+        self.piston = PistonClient(
+            bot=self,
+            urls=_env_list('PISTON_URLS', URLs.PISTON),
+            snapshot_directory=CATALOG_DIRECTORY,
+        )
+        self.rust = RustPlaygroundClient(bot=self, cache=ResultCache(directory=os.environ.get('RUST_CACHE_DIR')))
+        self.tio = TIOClient(bot=self, snapshot_directory=CATALOG_DIRECTORY)
 
-        self.loop.create_task(self._dispatch_first_ready())
-        self.load_extensions()
+        # Nothing here blocks logging in, commands wait for the stages they need through `requires`
+        self.startup = StartupPipeline()
+        self.startup.add('metrics', self.setup_metrics)
+        self.startup.add('http', self.setup_http)
+        self.startup.add('database', self.setup_database)
+        self.startup.add('catalogs', self.warm_catalogs, after=('http',))
+        self.startup.add('extensions', self.load_extensions)
 
-        self.loop.run_until_complete(self.setup_database())
+        self.loop.create_task(self._dispatch_first_ready())
+        self.loop.create_task(self.startup.run())
 
     async def process_commands(self, message: discord.Message) -> None:
         if message.author.bot:
             return
 
+        if not self.startup.is_ready('extensions'):
+            try:
+                await self.startup.wait_for('extensions', timeout=30)
+            except StageFailed:
+                pass
+
         ctx = await self.get_context(message, cls=Context)
         await self.invoke(ctx)
 
+    async def invoke(self, ctx: Context) -> None:
+        # Lets the watchdog tell which command was running when the event loop stalls
+        with self.watchdog.track(ctx):
+            await super().invoke(ctx)
+
     async def _dispatch_first_ready(self) -> None:
         await self.wait_until_ready()
         self.dispatch('first_ready')
@@ -107,12 +259,19 @@ class RustPy(commands.Bot):
     async def on_message(self, message: discord.Message) -> None:
         await self.process_commands(message)
 
-    async def on_command_error(self, ctx: commands.Context, error: Exception) -> None:
+    async def on_command_completion(self, ctx: Context) -> None:
+        COMMAND_SECONDS.labels(ctx.command.qualified_name, 'ok').observe(time.perf_counter() - ctx.started_at)
+
+    async def on_command_error(self, ctx: Context, error: Exception) -> None:
         if isinstance(error, commands.CommandNotFound):
             return
 
         error = getattr(error, 'original', error)
 
+        if ctx.command is not None:
+            elapsed = time.perf_counter() - ctx.started_at
+            COMMAND_SECONDS.labels(ctx.command.qualified_name, type(error).__name__).observe(elapsed)
+
         if isinstance(error, discord.NotFound) and error.code == 10062:
             return
 
@@ -126,5 +285,21 @@ class RustPy(commands.Bot):
             raise ValueError('The "TOKEN" environment variable must be supplied.')
 
     async def close(self) -> None:
-        await self.session.close()
+        self.startup.cancel()
+        self.watchdog.close()
+
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+
+        self.piston.pool.close()
+        self.piston.catalog.close()
+        self.tio.catalog.close()
+        self.offload.close()
+
+        if self.startup.is_ready('database'):
+            await self.db.close()
+
+        if self.startup.is_ready('http'):
+            await self.session.close()
+
         await super().close()
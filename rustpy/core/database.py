@@ -2,44 +2,162 @@ from __future__ import annotations
 
 import asyncio
 import asyncpg
+import logging
 import os
 import platform
+import uuid
 
-from dataclasses import dataclass
 from rustpy.constants import RustChannel, RustEdition, RustMode
+from rustpy.core.metrics import Histogram
+from rustpy.core.migrations import migrate
+from rustpy.helpers.cache import LRUCache
 
-from typing import Any, Awaitable, overload, Union
+from typing import Any, Awaitable, Optional, overload, Union
 
 __all__ = (
     'Database',
     'SettingsEntry',
+    'StatementRegistry',
 )
 
+log = logging.getLogger(__name__)
+
+# Postgres NOTIFY channel used to tell other bot processes a user's settings changed
+SETTINGS_CHANNEL = 'rustpy_settings'
+
+
+class _Connection(asyncpg.Connection):
+    __slots__ = ('statements',)
+
+    statements: dict[str, asyncpg.prepared_stmt.PreparedStatement]
+
+
+class StatementRegistry:
+    """Hot queries which are prepared once on every connection of the pool.
+
+    Running them through :meth:`_Database.run` skips parsing and planning them on every call,
+    and records their latency.
+    """
+
+    def __init__(self) -> None:
+        self.queries: dict[str, str] = {}
+        self.latency: dict[str, Histogram] = {}
+
+    def __repr__(self) -> str:
+        return f'<StatementRegistry statements={list(self.queries)!r}>'
+
+    def register(self, name: str, query: str) -> None:
+        self.queries[name] = query
+        self.latency[name] = Histogram()
+
+    async def prepare(self, connection: _Connection) -> None:
+        connection.statements = {
+            name: await connection.prepare(query)
+            for name, query in self.queries.items()
+        }
+
+
+STATEMENTS = StatementRegistry()
+
+STATEMENTS.register('fetch_settings', 'SELECT * FROM settings WHERE user_id = $1;')
+
+STATEMENTS.register('update_settings', """
+    WITH updated AS (
+        INSERT INTO settings (
+            preferred_rust_channel, 
+            preferred_rust_edition, 
+            preferred_rust_mode, 
+            user_id
+        ) 
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (user_id) DO UPDATE SET 
+            preferred_rust_channel = excluded.preferred_rust_channel, 
+            preferred_rust_edition = excluded.preferred_rust_edition, 
+            preferred_rust_mode = excluded.preferred_rust_mode
+        RETURNING *
+    )
+    SELECT 
+        updated.*, 
+        pg_notify($5, $6::text || ':' || updated.user_id) 
+    FROM 
+        updated;
+""")
+
+STATEMENTS.register('flush_settings', """
+    WITH updated AS (
+        INSERT INTO settings (
+            user_id, 
+            preferred_rust_channel, 
+            preferred_rust_edition, 
+            preferred_rust_mode
+        )
+        SELECT * FROM UNNEST($1::BIGINT[], $2::SMALLINT[], $3::SMALLINT[], $4::SMALLINT[])
+        ON CONFLICT (user_id) DO UPDATE SET 
+            preferred_rust_channel = excluded.preferred_rust_channel, 
+            preferred_rust_edition = excluded.preferred_rust_edition, 
+            preferred_rust_mode = excluded.preferred_rust_mode
+        RETURNING user_id
+    )
+    SELECT 
+        pg_notify($5, $6::text || ':' || updated.user_id) 
+    FROM 
+        updated;
+""")
+
 
 class _Database:
     _internal_pool: asyncpg.Pool
 
-    def __init__(self, *, loop: asyncio.AbstractEventLoop = None) -> None:
+    def __init__(
+        self,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+        statements: StatementRegistry = STATEMENTS,
+    ) -> None:
         self.loop: asyncio.AbstractEventLoop = loop or asyncio.get_event_loop()
-        self.loop.create_task(self._connect())
+        self.statements: StatementRegistry = statements
+        self._connect_task: asyncio.Task = self.loop.create_task(self._connect())
 
-    async def _connect(self) -> asyncpg.Pool:
+    async def wait_until_ready(self) -> None:
+        """Waits until the connection pool is created."""
+        await asyncio.shield(self._connect_task)
+
+    @staticmethod
+    def _connect_kwargs() -> dict[str, Any]:
         env_entry = 'BETA_DATABASE_PASSWORD' if platform.system() == 'Windows' else 'DATABASE_PASSWORD'
 
-        self._internal_pool = await asyncpg.create_pool(
+        return dict(
             host='localhost',
             user='postgres',
             database='rustpy',
             password=os.environ[env_entry]
         )
-        await self._run_initial_query()
 
-    async def _run_initial_query(self) -> None:
-        def wrapper() -> str:
-            with open('schema.sql') as fp:
-                return fp.read()
+    @staticmethod
+    def _pool_kwargs() -> dict[str, Any]:
+        env = os.environ
 
-        await self.execute(await asyncio.to_thread(wrapper))
+        return dict(
+            min_size=int(env.get('DATABASE_POOL_MIN_SIZE', 2)),
+            max_size=int(env.get('DATABASE_POOL_MAX_SIZE', 10)),
+            max_inactive_connection_lifetime=float(env.get('DATABASE_POOL_MAX_INACTIVE_LIFETIME', 300.0)),
+            statement_cache_size=int(env.get('DATABASE_STATEMENT_CACHE_SIZE', 100)),
+        )
+
+    async def _connect(self) -> asyncpg.Pool:
+        # The schema has to exist before statements using it can be prepared on the pool's connections
+        connection = await asyncpg.connect(**self._connect_kwargs())
+        try:
+            await migrate(connection)
+        finally:
+            await connection.close()
+
+        self._internal_pool = await asyncpg.create_pool(
+            **self._connect_kwargs(),
+            **self._pool_kwargs(),
+            connection_class=_Connection,
+            init=self.statements.prepare,
+        )
 
     @overload
     def acquire(self, *, timeout: float = None) -> Awaitable[asyncpg.Connection]:
@@ -60,40 +178,148 @@ class _Database:
     def fetchval(self, query: str, *args: Any, column: Union[str, int] = 0, timeout: float = None) -> Awaitable[Any]:
         return self._internal_pool.fetchval(query, *args, column=column, timeout=timeout)
 
+    async def run(self, name: str, *args: Any, method: str = 'fetch', timeout: float = None) -> Any:
+        """Runs a statement registered in :attr:`statements` with the given method, e.g. ``fetchrow``."""
+        with self.statements.latency[name].time():
+            async with self.acquire() as connection:
+                statement = connection.statements[name]
+                return await getattr(statement, method)(*args, timeout=timeout)
+
+    async def close(self) -> None:
+        await self._internal_pool.close()
+
 
 class Database(_Database):
-    def __init__(self, *, loop: asyncio.AbstractEventLoop = None) -> None:
+    def __init__(
+        self,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+        settings_cache_size: int = 50_000,
+        settings_cache_ttl: float = 3600.0,
+        write_behind: bool = False,
+        flush_interval: float = 5.0,
+        flush_threshold: int = 100,
+    ) -> None:
         super().__init__(loop=loop)
-        self._settings_cache: dict[int, SettingsEntry] = {}
+        self._settings_cache: LRUCache[int, SettingsEntry] = LRUCache(settings_cache_size, ttl=settings_cache_ttl)
+
+        # Identifies notifications sent by this process, so that it doesn't invalidate its own updates
+        self._origin: str = uuid.uuid4().hex
+        self._listener: Optional[asyncpg.Connection] = None
+        self.loop.create_task(self._listen())
+
+        # With write-behind, settings updates are only applied in memory and written in batches later
+        self.write_behind: bool = write_behind
+        self.flush_interval: float = flush_interval
+        self.flush_threshold: int = flush_threshold
+
+        self._dirty: dict[int, SettingsEntry] = {}
+        self._flush_lock: asyncio.Lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = self.loop.create_task(self._flush_loop()) if write_behind else None
+        self._threshold_flush: Optional[asyncio.Task] = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                self._listener = await asyncpg.connect(**self._connect_kwargs())
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(5)
+            else:
+                break
+
+        await self._listener.add_listener(SETTINGS_CHANNEL, self._on_settings_notification)
+        self._listener.add_termination_listener(self._on_listener_terminated)
+
+    def _on_settings_notification(self, _connection: Any, _pid: int, _channel: str, payload: str) -> None:
+        origin, _, user_id = payload.partition(':')
+
+        if origin != self._origin:
+            self._settings_cache.pop(int(user_id))
+
+    def _on_listener_terminated(self, _connection: Any) -> None:
+        if self._listener is None:
+            return  # We closed it ourselves
+
+        # Notifications could be missed until we listen again, so nothing cached can be trusted
+        self._settings_cache.clear()
+        self.loop.create_task(self._listen())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # The entries stay dirty, they will be retried on the next flush
+                log.exception('Could not flush settings updates')
+
+    async def flush(self) -> None:
+        """Writes every pending settings update in a single statement."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            dirty, self._dirty = self._dirty, {}
+
+            entries = list(dirty.values())
+            try:
+                await self.run(
+                    'flush_settings',
+                    [entry.user_id for entry in entries],
+                    [entry.rust_channel.value for entry in entries],
+                    [entry.rust_edition.value for entry in entries],
+                    [entry.rust_mode.value for entry in entries],
+                    SETTINGS_CHANNEL,
+                    self._origin,
+                )
+            except BaseException:
+                # Entries updated again since are already in the new dirty map and are newer
+                self._dirty = {**dirty, **self._dirty}
+                raise
+
+    def _on_threshold_flush_done(self, task: asyncio.Task) -> None:
+        self._threshold_flush = None
+
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            # The entries stay dirty, the flush loop retries them
+            log.error('Could not flush settings updates', exc_info=exc)
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
 
-    async def setup(self, user_id: int) -> None:
-        query = """
-                INSERT INTO settings (user_id) VALUES ($1)
-                ON CONFLICT DO NOTHING;
-                """
-        await self.execute(query, user_id)
+        try:
+            await self.flush()
+        except Exception:
+            log.exception('Could not flush settings updates while closing, %d are lost', len(self._dirty))
+        finally:
+            try:
+                if listener := self._listener:
+                    self._listener = None
+                    await listener.close()
+            finally:
+                await super().close()
+
+    @property
+    def settings_cache(self) -> LRUCache[int, SettingsEntry]:
+        return self._settings_cache
 
     async def fetch_settings(self, user_id: int) -> SettingsEntry:
-        query = 'SELECT * FROM settings WHERE user_id = $1;'
-
-        if record := await self.fetchrow(query, user_id):
-            entry = SettingsEntry(
-                user_id=user_id,
-                rust_channel=RustChannel(record['preferred_rust_channel']),
-                rust_edition=RustEdition(record['preferred_rust_edition']),
-                rust_mode=RustMode(record['preferred_rust_mode']),
-            )
-            self._settings_cache[user_id] = entry
-            return entry
+        if record := await self.run('fetch_settings', user_id, method='fetchrow'):
+            entry = SettingsEntry.from_record(record)
         else:
-            await self.setup(user_id)
-            return await self.fetch_settings(user_id)
+            # Users still on the default settings don't get a row until they change something
+            entry = SettingsEntry.default(user_id)
+
+        self._settings_cache.set(user_id, entry)
+        return entry
 
     async def get_settings(self, user_id: int) -> SettingsEntry:
-        try:
-            return self._settings_cache[user_id]
-        except KeyError:
-            return await self.fetch_settings(user_id)
+        if (entry := self._dirty.get(user_id) or self._settings_cache.get(user_id)) is not None:
+            return entry
+
+        return await self.fetch_settings(user_id)
 
     async def update_rust_settings(
         self,
@@ -117,24 +343,26 @@ class Database(_Database):
         if not any((channel, edition, mode)):
             return
 
-        query = """
-                UPDATE 
-                    settings 
-                SET 
-                    preferred_rust_channel = $1, 
-                    preferred_rust_edition = $2, 
-                    preferred_rust_mode = $3
-                WHERE 
-                    user_id = $4
-                RETURNING *;
-                """
-
-        new = await self.fetchrow(
-            query,
+        if self.write_behind:
+            entry.rust_channel = channel or entry.rust_channel
+            entry.rust_edition = edition or entry.rust_edition
+            entry.rust_mode = mode or entry.rust_mode
+
+            self._dirty[user_id] = entry
+            if len(self._dirty) >= self.flush_threshold and self._threshold_flush is None:
+                self._threshold_flush = self.loop.create_task(self.flush())
+                self._threshold_flush.add_done_callback(self._on_threshold_flush_done)
+            return
+
+        new = await self.run(
+            'update_settings',
             (channel or entry.rust_channel).value,
             (edition or entry.rust_edition).value,
             (mode or entry.rust_mode).value,
-            user_id
+            user_id,
+            SETTINGS_CHANNEL,
+            self._origin,
+            method='fetchrow',
         )
 
         entry.rust_channel = RustChannel(new['preferred_rust_channel'])
@@ -142,9 +370,81 @@ class Database(_Database):
         entry.rust_mode = RustMode(new['preferred_rust_mode'])
 
 
-@dataclass
 class SettingsEntry:
-    user_id: int
-    rust_channel: RustChannel
-    rust_edition: RustEdition
-    rust_mode: RustMode
+    """A user's settings.
+
+    Every setting is a small enum, so they are packed into a single int to keep
+    the memory of caching millions of these flat.
+    """
+
+    __slots__ = ('user_id', '_packed')
+
+    def __init__(
+        self,
+        *,
+        user_id: int,
+        rust_channel: RustChannel,
+        rust_edition: RustEdition,
+        rust_mode: RustMode,
+    ) -> None:
+        self.user_id: int = user_id
+        # 4 bits per setting: channel, edition, then mode
+        self._packed: int = rust_channel.value | rust_edition.value << 4 | rust_mode.value << 8
+
+    @classmethod
+    def default(cls, user_id: int) -> SettingsEntry:
+        """The settings of a user who never changed them, these must match the defaults in the schema."""
+        return cls(
+            user_id=user_id,
+            rust_channel=RustChannel.NIGHTLY,
+            rust_edition=RustEdition.E2018,
+            rust_mode=RustMode.DEBUG,
+        )
+
+    @classmethod
+    def from_record(cls, record: asyncpg.Record) -> SettingsEntry:
+        return cls(
+            user_id=record['user_id'],
+            rust_channel=RustChannel(record['preferred_rust_channel']),
+            rust_edition=RustEdition(record['preferred_rust_edition']),
+            rust_mode=RustMode(record['preferred_rust_mode']),
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f'<SettingsEntry user_id={self.user_id} rust_channel={self.rust_channel.name} '
+            f'rust_edition={self.rust_edition.name} rust_mode={self.rust_mode.name}>'
+        )
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, SettingsEntry) and (self.user_id, self._packed) == (other.user_id, other._packed)
+
+    def _get(self, shift: int) -> int:
+        return self._packed >> shift & 0xF
+
+    def _set(self, shift: int, value: int) -> None:
+        self._packed = self._packed & ~(0xF << shift) | value << shift
+
+    @property
+    def rust_channel(self) -> RustChannel:
+        return RustChannel(self._get(0))
+
+    @rust_channel.setter
+    def rust_channel(self, value: RustChannel) -> None:
+        self._set(0, value.value)
+
+    @property
+    def rust_edition(self) -> RustEdition:
+        return RustEdition(self._get(4))
+
+    @rust_edition.setter
+    def rust_edition(self, value: RustEdition) -> None:
+        self._set(4, value.value)
+
+    @property
+    def rust_mode(self) -> RustMode:
+        return RustMode(self._get(8))
+
+    @rust_mode.setter
+    def rust_mode(self, value: RustMode) -> None:
+        self._set(8, value.value)
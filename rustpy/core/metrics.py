@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Generic, Iterator, Literal, Optional, Sequence, TypeVar, Union
+
+from aiohttp import web
+
+__all__ = (
+    'DEFAULT_BUCKETS',
+    'Counter',
+    'Histogram',
+    'Family',
+    'Registry',
+    'LoopLagMonitor',
+    'METRICS',
+    'serve_metrics',
+)
+
+M = TypeVar('M', bound=Union['Counter', 'Histogram'])
+Kind = Literal['counter', 'gauge', 'histogram']
+
+# In seconds
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+class Counter:
+    """A value which only goes up, e.g. the amount of requests made."""
+
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value: float = 0.0
+
+    def __repr__(self) -> str:
+        return f'<Counter value={self.value}>'
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Histogram:
+    """Counts observed values into fixed buckets, Prometheus-style."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        self.counts: list[int] = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def __repr__(self) -> str:
+        return f'<Histogram count={self.count} p50={self.quantile(0.5)} p99={self.quantile(0.99)}>'
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float) -> float:
+        """Estimates the given quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return float('inf')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+class Family(Generic[M]):
+    """Metrics sharing a name, told apart by the values of their labels."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        kind: Kind,
+        *,
+        labels: Sequence[str] = (),
+        factory: Optional[Callable[[], M]] = None,
+        collect: Optional[Callable[[], dict[tuple[str, ...], Union[float, M]]]] = None,
+    ) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.kind: Kind = kind
+        self.label_names: tuple[str, ...] = tuple(labels)
+
+        self._factory: Optional[Callable[[], M]] = factory
+        self._collect: Optional[Callable[[], dict[tuple[str, ...], Union[float, M]]]] = collect
+        self._metrics: dict[tuple[str, ...], M] = {}
+
+    def __repr__(self) -> str:
+        return f'<Family name={self.name!r} kind={self.kind!r} labels={self.label_names!r}>'
+
+    def labels(self, *values: str) -> M:
+        try:
+            return self._metrics[values]
+        except KeyError:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} takes the labels {self.label_names!r}.') from None
+
+            metric = self._metrics[values] = self._factory()
+            return metric
+
+    def _samples(self) -> dict[tuple[str, ...], Union[float, M]]:
+        return self._collect() if self._collect is not None else self._metrics
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+
+        for values, sample in self._samples().items():
+            if isinstance(sample, Histogram):
+                seen = 0
+                for bound, count in zip((*sample.buckets, float('inf')), sample.counts):
+                    seen += count
+                    le = _format_labels(self.label_names, values, f'le="{_format_value(bound)}"')
+                    yield f'{self.name}_bucket{le} {seen}'
+
+                labels = _format_labels(self.label_names, values)
+                yield f'{self.name}_sum{labels} {_format_value(sample.sum)}'
+                yield f'{self.name}_count{labels} {sample.count}'
+            else:
+                value = sample.value if isinstance(sample, Counter) else sample
+                yield f'{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}'
+
+
+class Registry:
+    """Every metric the bot exports, rendered in the Prometheus text format by :meth:`render`."""
+
+    def __init__(self) -> None:
+        self.families: dict[str, Family] = {}
+
+    def __repr__(self) -> str:
+        return f'<Registry families={list(self.families)!r}>'
+
+    def _add(self, family: Family[M]) -> Family[M]:
+        if family.name in self.families:
+            raise ValueError(f'A metric named {family.name!r} already exists.')
+
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, *, labels: Sequence[str] = ()) -> Family[Counter]:
+        return self._add(Family(name, documentation, 'counter', labels=labels, factory=Counter))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        *,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Family[Histogram]:
+        return self._add(Family(name, documentation, 'histogram', labels=labels, factory=lambda: Histogram(buckets)))
+
+    def collector(
+        self,
+        name: str,
+        documentation: str,
+        kind: Kind,
+        func: Callable[[], dict[tuple[str, ...], Union[float, Histogram]]],
+        *,
+        labels: Sequence[str] = (),
+    ) -> Family:
+        """Adds metrics whose values are read through ``func`` whenever they are rendered, e.g. cache statistics."""
+        if name in self.families:
+            del self.families[name]  # Collectors are replaced, e.g. when the bot is set up again
+
+        return self._add(Family(name, documentation, kind, labels=labels, collect=func))
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Registry()
+
+COMMAND_SECONDS = METRICS.histogram(
+    'rustpy_command_seconds',
+    'Time taken by commands from invocation to completion.',
+    labels=('command', 'status'),
+)
+
+COMMAND_PHASE_SECONDS = METRICS.histogram(
+    'rustpy_command_phase_seconds',
+    'Time taken by each phase of commands, e.g. get_code or execute.',
+    labels=('command', 'phase'),
+)
+
+UPSTREAM_REQUESTS = METRICS.counter(
+    'rustpy_upstream_requests_total',
+    'Requests made to upstream hosts, by response status.',
+    labels=('host', 'status'),
+)
+
+UPSTREAM_ERRORS = METRICS.counter(
+    'rustpy_upstream_errors_total',
+    'Requests to upstream hosts which failed without a response.',
+    labels=('host', 'error'),
+)
+
+UPSTREAM_BYTES = METRICS.counter(
+    'rustpy_upstream_bytes_total',
+    'Bytes of request and response bodies exchanged with upstream hosts.',
+    labels=('host', 'direction'),
+)
+
+UPSTREAM_SECONDS = METRICS.histogram(
+    'rustpy_upstream_request_seconds',
+    'Time until upstream hosts responded.',
+    labels=('host',),
+)
+
+QUEUE_WAIT_SECONDS = METRICS.histogram(
+    'rustpy_scheduler_queue_wait_seconds',
+    'Time execution requests waited for a slot on their backend.',
+    labels=('backend',),
+)
+
+LOOP_LAG_SECONDS = METRICS.histogram(
+    'rustpy_event_loop_lag_seconds',
+    'How late the event loop woke up a task which slept for a fixed interval.',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+LOOP_STALLS = METRICS.counter(
+    'rustpy_event_loop_stalls_total',
+    'Times the event loop was blocked for longer than the watchdog threshold.',
+)
+
+
+class LoopLagMonitor:
+    """Measures event loop lag by sleeping for ``interval`` seconds and timing how late the wake up is."""
+
+    def __init__(self, *, interval: float = 0.5, histogram: Histogram = None) -> None:
+        self.interval: float = interval
+        self.histogram: Histogram = histogram or LOOP_LAG_SECONDS.labels()
+        self.last_lag: float = 0.0
+        self.deadline: float = 0.0  # When the current sleep should end, 0 while not running
+        self._task: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return f'<LoopLagMonitor interval={self.interval} last_lag={self.last_lag:.4f}>'
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            self.deadline = start + self.interval
+            await asyncio.sleep(self.interval)
+
+            self.last_lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.histogram.observe(self.last_lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.deadline = 0.0
+
+
+async def serve_metrics(registry: Registry = METRICS, *, host: str = '127.0.0.1', port: int = 9108) -> web.AppRunner:
+    """Serves the registry on ``/metrics``, returning the runner so that it can be cleaned up."""
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
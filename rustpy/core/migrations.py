@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+
+import asyncpg
+
+from typing import NamedTuple
+
+__all__ = (
+    'Migration',
+    'discover_migrations',
+    'migrate',
+)
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS_DIRECTORY = 'migrations'
+
+# Migration files are named like 0001_create_settings.sql, and are applied in order of their number
+MIGRATION_FILE_REGEX: re.Pattern[str] = re.compile(r'(?P<version>\d+)_(?P<name>\w+)\.sql')
+
+# Arbitrary key of the advisory lock held while migrating, so that concurrent shards don't race
+ADVISORY_LOCK_KEY = 0x7275_7374_7079  # "rustpy"
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    query: str
+
+    def __repr__(self) -> str:
+        return f'<Migration version={self.version} name={self.name!r}>'
+
+
+def discover_migrations(directory: str = MIGRATIONS_DIRECTORY) -> list[Migration]:
+    migrations = []
+
+    for file in os.listdir(directory):
+        if match := MIGRATION_FILE_REGEX.fullmatch(file):
+            with open(os.path.join(directory, file), encoding='utf-8') as fp:
+                migrations.append(Migration(int(match.group('version')), match.group('name'), fp.read()))
+
+    migrations.sort()
+
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError('Two migrations share the same version.')
+
+    return migrations
+
+
+async def _current_version(connection: asyncpg.Connection) -> int:
+    try:
+        return await connection.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version;')
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(connection: asyncpg.Connection, *, directory: str = MIGRATIONS_DIRECTORY) -> list[Migration]:
+    """Applies every migration newer than the database's schema version, returning the ones applied."""
+    migrations = await asyncio.to_thread(discover_migrations, directory)
+
+    # Fast path, which is what almost every restart takes
+    if not migrations or await _current_version(connection) >= migrations[-1].version:
+        return []
+
+    await connection.execute('SELECT pg_advisory_lock($1);', ADVISORY_LOCK_KEY)
+    try:
+        await connection.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER NOT NULL PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+            );
+        """)
+
+        # Another process might have migrated while we were waiting for the lock
+        current = await _current_version(connection)
+        applied = []
+
+        for migration in migrations:
+            if migration.version <= current:
+                continue
+
+            async with connection.transaction():
+                await connection.execute(migration.query)
+                await connection.execute(
+                    'INSERT INTO schema_version (version, name) VALUES ($1, $2);',
+                    migration.version,
+                    migration.name,
+                )
+
+            applied.append(migration)
+            log.info('Applied migration %d: %s', migration.version, migration.name)
+
+        return applied
+    finally:
+        await connection.execute('SELECT pg_advisory_unlock($1);', ADVISORY_LOCK_KEY)
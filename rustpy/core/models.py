@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import discord
+import time
 from discord.ext import commands
 
-from typing import TYPE_CHECKING, Union
+from contextlib import asynccontextmanager, contextmanager
+from rustpy.core.metrics import COMMAND_PHASE_SECONDS
+from typing import AsyncIterator, Iterator, TYPE_CHECKING, Union
 
 if TYPE_CHECKING:
     from rustpy.core.bot import RustPy
@@ -29,10 +32,52 @@ class Cog(commands.Cog):
 class Context(commands.Context):
     bot: RustPy
 
+    def __init__(self, **attrs) -> None:
+        super().__init__(**attrs)
+        self.started_at: float = time.perf_counter()
+
     @property
     def db(self) -> Database:
         return self.bot.db
 
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Records how long this phase of the command took, e.g. fetching the code or sending the output."""
+        command = self.command.qualified_name if self.command else 'unknown'
+
+        with COMMAND_PHASE_SECONDS.labels(command, name).time():
+            yield
+
+    @asynccontextmanager
+    async def scheduled(self) -> AsyncIterator[None]:
+        """Attributes execution requests made in this block to this context's guild.
+
+        If the requests have to wait in a queue, the user is told their position in it as it moves.
+        The block is recorded as the command's ``execute`` phase.
+        """
+        message = None
+
+        async def on_queued(backend: str, position: int) -> None:
+            nonlocal message
+            content = f'Lots of code is being run right now, you are #{position} in the queue for {backend}.'
+
+            try:
+                if message is None:
+                    message = await self.send(content)
+                else:
+                    await message.edit(content=content)
+            except discord.HTTPException:
+                pass
+
+        guild_id = self.guild.id if self.guild else self.channel.id
+
+        try:
+            with self.phase('execute'), self.bot.scheduler.submission(guild_id, on_queued=on_queued):
+                yield
+        finally:
+            if message is not None:
+                self.bot.loop.create_task(message.delete())
+
     async def try_reaction(self, reaction: EmojiType, *, message: discord.Message = None) -> bool:
         message = message or self.message
         try:
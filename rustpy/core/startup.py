@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from discord.ext import commands
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rustpy.core.models import Context
+
+__all__ = (
+    'StartupPipeline',
+    'StageFailed',
+    'requires',
+)
+
+log = logging.getLogger(__name__)
+
+
+class _Stage(NamedTuple):
+    name: str
+    func: Callable[[], Awaitable[None]]
+    after: tuple[str, ...]
+
+
+class StartupPipeline:
+    """Runs the bot's startup stages.
+
+    Every stage starts as soon as the stages it depends on are done, so independent
+    stages run concurrently. Anything can wait for specific stages through :meth:`wait_for`,
+    rather than waiting for the whole startup to finish.
+    """
+
+    def __init__(self) -> None:
+        self.timings: dict[str, float] = {}
+        self._stages: dict[str, _Stage] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def __repr__(self) -> str:
+        return f'<StartupPipeline stages={list(self._stages)!r} done={list(self.timings)!r}>'
+
+    def add(self, name: str, func: Callable[[], Awaitable[None]], *, after: Iterable[str] = ()) -> None:
+        self._stages[name] = _Stage(name, func, tuple(after))
+
+    async def _run_stage(self, stage: _Stage) -> None:
+        await asyncio.gather(*(self._tasks[dependency] for dependency in stage.after))
+
+        start = time.perf_counter()
+        await stage.func()
+        self.timings[stage.name] = elapsed = time.perf_counter() - start
+        log.debug('Startup stage %r finished in %.0fms', stage.name, elapsed * 1000)
+
+    async def run(self) -> dict[str, float]:
+        """Runs every stage, returning how long each of them took in seconds."""
+        for name in self._stages:
+            self._tasks[name] = asyncio.create_task(self._run_stage(self._stages[name]), name=f'startup:{name}')
+
+        results = await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+        for name, result in zip(self._tasks, results):
+            if isinstance(result, BaseException):
+                log.error('Startup stage %r failed', name, exc_info=result)
+
+        fmt = ', '.join(f'{name}: {elapsed * 1000:.0f}ms' for name, elapsed in self.timings.items())
+        log.info('Startup finished (%s)', fmt)
+        return self.timings
+
+    def is_ready(self, name: str) -> bool:
+        return name in self.timings
+
+    async def _wait_for_stage(self, name: str) -> None:
+        while name not in self._tasks:  # The pipeline hasn't started yet
+            await asyncio.sleep(0.1)
+
+        await asyncio.shield(self._tasks[name])
+
+    async def wait_for(self, *names: str, timeout: Optional[float] = None) -> None:
+        """Waits until the given stages are done, raising :class:`KeyError` for names which aren't stages."""
+        if unknown := [name for name in names if name not in self._stages]:
+            raise KeyError(f'Unknown startup stages: {", ".join(unknown)}')
+
+        for name in names:
+            if self.is_ready(name):
+                continue
+
+            try:
+                await asyncio.wait_for(self._wait_for_stage(name), timeout=timeout)
+            except asyncio.TimeoutError:
+                raise StageFailed(name, 'is taking too long') from None
+            except Exception as exc:
+                raise StageFailed(name, 'failed') from exc
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+
+
+class StageFailed(commands.CheckFailure):
+    """Raised when something waits for a startup stage which failed or is taking too long."""
+
+    def __init__(self, stage: str, reason: str) -> None:
+        self.stage: str = stage
+        super().__init__(f'The bot is still starting up ({stage} {reason}), please try again in a bit.')
+
+
+def requires(*stages: str, timeout: float = 30.0) -> Callable[[commands.Command], commands.Command]:
+    """A check which waits for the given startup stages before letting the command run."""
+    async def predicate(ctx: Context) -> bool:
+        await ctx.bot.startup.wait_for(*stages, timeout=timeout)
+        return True
+
+    return commands.check(predicate)
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import datetime
+import linecache
+import logging
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from rustpy.core.metrics import LOOP_STALLS, Histogram, LoopLagMonitor
+from typing import Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rustpy.core.models import Context
+
+__all__ = (
+    'LoopWatchdog',
+    'Stall',
+)
+
+log = logging.getLogger(__name__)
+
+Frame = tuple[str, int, str]  # File name, line number and function name
+Stack = tuple[Frame, ...]  # Outermost frame first
+
+# Frames further out than this are dropped from samples, they're the same event loop internals every time
+MAX_STACK_DEPTH = 48
+
+
+class Stall:
+    """A stretch of time the event loop was blocked for, with the stacks sampled while it was."""
+
+    __slots__ = ('started_at', 'duration', 'samples', 'commands')
+
+    def __init__(self, started_at: datetime.datetime) -> None:
+        self.started_at: datetime.datetime = started_at
+        self.duration: float = 0.0
+        self.samples: collections.Counter[Stack] = collections.Counter()
+        self.commands: collections.Counter[str] = collections.Counter()  # Command -> samples it was running in
+
+    def __repr__(self) -> str:
+        return f'<Stall duration={self.duration:.3f} samples={self.sample_count} command={self.command!r}>'
+
+    @property
+    def sample_count(self) -> int:
+        return sum(self.samples.values())
+
+    @property
+    def command(self) -> Optional[str]:
+        """The command which was running in most samples, if any."""
+        return most[0][0] if (most := self.commands.most_common(1)) else None
+
+    def format(self, *, depth: int = 12) -> str:
+        """Formats the stall with its most sampled stack, limited to the ``depth`` innermost frames."""
+        lines = [
+            f'Event loop blocked for {self.duration * 1000:.0f}ms at {self.started_at:%Y-%m-%d %H:%M:%S} UTC',
+            f'Running command: {self.command or "none"}',
+        ]
+
+        if not self.samples:
+            lines.append('No stacks were sampled.')
+            return '\n'.join(lines)
+
+        stack, count = self.samples.most_common(1)[0]
+        lines.append(f'Most sampled stack ({count}/{self.sample_count} samples), most recent call last:')
+
+        for filename, lineno, name in stack[-depth:]:
+            lines.append(f'  File "{filename}", line {lineno}, in {name}')
+
+            if line := linecache.getline(filename, lineno).strip():
+                lines.append(f'    {line}')
+
+        return '\n'.join(lines)
+
+
+class LoopWatchdog(LoopLagMonitor):
+    """Measures event loop lag like :class:`LoopLagMonitor`, and profiles the loop whenever it stalls.
+
+    A thread checks whether the loop woke up on time. Once it is ``threshold`` seconds late, the thread
+    samples the loop's stack every ``sample_interval`` seconds until it catches up. The stall is then
+    logged and kept in :attr:`stalls`, along with the command which was running, see :meth:`track`.
+
+    Blocking shorter than ``threshold`` plus ``interval`` might not be caught, so keep the interval short.
+    C code which holds the GIL, like a long regex search, can't be sampled while it runs, but the
+    thread gets to sample its caller right after it returns.
+    """
+
+    def __init__(
+        self,
+        *,
+        interval: float = 0.05,
+        threshold: float = 0.1,
+        sample_interval: float = 0.01,
+        max_samples: int = 500,
+        history: int = 20,
+        histogram: Histogram = None,
+    ) -> None:
+        super().__init__(interval=interval, histogram=histogram)
+
+        self.threshold: float = threshold
+        self.sample_interval: float = sample_interval
+        self.max_samples: int = max_samples
+        self.stalls: collections.deque[Stall] = collections.deque(maxlen=history)
+        self.stall_count: int = 0
+
+        self._commands: dict[asyncio.Task, str] = {}
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping: threading.Event = threading.Event()
+
+    def __repr__(self) -> str:
+        return f'<LoopWatchdog threshold={self.threshold} last_lag={self.last_lag:.4f} stalls={self.stall_count}>'
+
+    @contextmanager
+    def track(self, ctx: Context) -> Iterator[None]:
+        """Attributes stalls happening while the current task is running to the command being invoked."""
+        if (task := asyncio.current_task()) is None or ctx.command is None:
+            yield
+            return
+
+        previous = self._commands.get(task)  # Commands can invoke others, e.g. jishaku's sudo
+        self._commands[task] = f'{ctx.command.qualified_name} ({ctx.message.jump_url})'
+        try:
+            yield
+        finally:
+            if previous is None:
+                del self._commands[task]
+            else:
+                self._commands[task] = previous
+
+    def start(self) -> None:
+        super().start()
+
+        if self._thread is None:
+            self._loop_thread = threading.get_ident()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        super().close()
+
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self, stall: Stall) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = []
+        frames = set()
+
+        while frame is not None:
+            frames.add(id(frame))
+            stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+            frame = frame.f_back
+
+        stall.samples[tuple(reversed(stack[:MAX_STACK_DEPTH]))] += 1
+
+        # The outermost coroutine of a task is on the stack whenever that task is the one running
+        for task, command in self._commands.copy().items():
+            if id(getattr(task.get_coro(), 'cr_frame', None)) in frames:
+                stall.commands[command] += 1
+                break
+
+    def _finish(self, stall: Stall) -> None:
+        self.stalls.append(stall)
+        self.stall_count += 1
+        LOOP_STALLS.labels().inc()
+
+        log.warning('%s', stall.format())
+
+    def _watch(self) -> None:
+        stall = None
+        timeout = self.threshold / 2
+
+        while not self._stopping.wait(timeout):
+            lag = time.perf_counter() - self.deadline if self.deadline else 0.0
+
+            if lag < self.threshold:
+                if stall is not None:
+                    # The loop records how late it woke up before it sleeps again
+                    stall.duration = max(stall.duration, self.last_lag)
+                    self._finish(stall)
+                    stall = None
+
+                timeout = self.threshold / 2
+                continue
+
+            if stall is None:
+                started_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=lag)
+                stall = Stall(started_at)
+
+            stall.duration = lag
+            if stall.sample_count < self.max_samples:
+                self._sample(stall)
+
+            timeout = self.sample_interval
@@ -6,7 +6,9 @@ import discord
 from discord.ext import commands
 
 from rustpy.core import Cog, Context, RustPy
+from rustpy.core.startup import requires
 from rustpy.constants import DEFAULT_GROUP_KWARGS, RustChannel, RustEdition, RustMode
+from rustpy.helpers.common import send_output
 
 from typing import TYPE_CHECKING
 
@@ -110,6 +112,7 @@ class MiscCommands(Cog, name='Miscellaneous'):
 
     @settings.command('rust', aliases=('rs', 'ferris'))
     @commands.max_concurrency(1, commands.BucketType.user)
+    @requires('database')
     async def settings_rust(self, ctx: Context) -> None:
         """Configure Rust-related settings for this bot.
 
@@ -128,6 +131,22 @@ class MiscCommands(Cog, name='Miscellaneous'):
         await ctx.reply(content='Press "Save" to save your changes.', view=view)
         await view.wait()
 
+    @commands.command('diagnostics', aliases=('diag', 'stalls'), hidden=True)
+    @commands.is_owner()
+    async def diagnostics(self, ctx: Context, count: int = 3) -> None:
+        """Shows the event loop lag and the latest stalls caught by the watchdog, most recent first."""
+        watchdog = self.bot.watchdog
+        lag = watchdog.histogram
+
+        report = [
+            f'Loop lag: {watchdog.last_lag * 1000:.1f}ms now, p50 <= {lag.quantile(0.5) * 1000:g}ms, '
+            f'p99 <= {lag.quantile(0.99) * 1000:g}ms over {lag.count} samples',
+            f'Stalls over {watchdog.threshold * 1000:g}ms since startup: {watchdog.stall_count}',
+        ]
+        report += (stall.format() for stall in reversed(list(watchdog.stalls)[-count:]))
+
+        await send_output(ctx, '\n\n'.join(report), syntax='py')
+
 
 def setup(bot: RustPy) -> None:
     bot.add_cog(MiscCommands(bot))
@@ -1,12 +1,17 @@
 import asyncio
 
+import aiohttp
 import discord
 from discord.ext import commands
 from jishaku.codeblocks import codeblock_converter
 
 from rustpy.core import Cog, Context, RustPy
-from rustpy.helpers import PistonFile, PistonResponse, PistonRuntime, PistonRuntimeNotFound
-from rustpy.helpers.common import get_code, send_output
+from rustpy.core.startup import requires
+from rustpy.helpers import PistonFile, PistonHTTPException, PistonResponse, PistonRuntime, PistonRuntimeNotFound
+from rustpy.helpers.batch import BatchEntry, render_report
+from rustpy.helpers.breaker import CircuitOpen
+from rustpy.helpers.pool import NoBackendAvailable
+from rustpy.helpers.common import MAX_INLINE_CHARACTERS, LiveOutput, Output, get_code, send_output
 
 from typing import Optional
 
@@ -15,16 +20,58 @@ class PistonRuntimeConverter(commands.Converter):
     async def convert(self, ctx: commands.Context, argument: str) -> PistonRuntime:
         try:
             return await ctx.bot.piston.get_runtime(argument)
-        except PistonRuntimeNotFound:
+        except PistonRuntimeNotFound as exc:
+            if exc.close_matches:
+                suggestions = '`, `'.join(exc.close_matches[:3])
+                raise commands.BadArgument(f'Piston runtime with that name not found.\nDid you mean: `{suggestions}`?')
+
             raise commands.BadArgument('Piston runtime with that name not found.')
 
 
+# Most runtimes run-many accepts
+MAX_BATCH_RUNTIMES = 6
+
+# Errors which mean Piston itself is unavailable, rather than something being wrong with the code.
+# Server errors from Piston count too, see _piston_unavailable.
+PISTON_UNAVAILABLE_ERRORS = (
+    CircuitOpen,
+    NoBackendAvailable,
+    asyncio.TimeoutError,
+    aiohttp.ClientConnectorError,
+)
+
+
+def _piston_unavailable(exc: Exception) -> bool:
+    if isinstance(exc, PistonHTTPException):
+        return exc.status is not None and exc.status >= 500
+
+    return isinstance(exc, PISTON_UNAVAILABLE_ERRORS)
+
+
 class OtherCommands(Cog, name='Other'):
     """Other programming-related commands that don't apply to just Python or Rust."""
 
+    @staticmethod
+    async def _run_on_tio(ctx: Context, code: str, language: str, *, live: LiveOutput) -> None:
+        async with ctx.typing(), ctx.scheduled():
+            output = await ctx.bot.tio.run(code, language)
+
+        reaction = '\U0001f44d' if output.successful else '\u274c'
+        ctx.bot.loop.create_task(ctx.try_reaction(reaction))
+
+        # Output which fits in a message is all that's decoded, anything longer is uploaded whole
+        text = output.preview(MAX_INLINE_CHARACTERS + 1)
+        if len(text) > MAX_INLINE_CHARACTERS:
+            text = await ctx.bot.offload.run(getattr, output, 'output', size=output.output_size)
+
+        # Replaces whatever Piston streamed before it became unavailable
+        fmt = Output(text, f'\n\nExit code: {output.exit_code} (Piston is unavailable, ran on TIO instead)')
+        await live.finish(fmt)
+
     @commands.command('run', aliases=['piston', 'exec', 'execute', 'e'])
     @commands.cooldown(2, 6, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
+    @requires('http')
     async def run_piston(
         self,
         ctx: Context,
@@ -71,12 +118,23 @@ class OtherCommands(Cog, name='Other'):
             await ctx.try_reaction('\U0001f550')
 
         task = ctx.bot.loop.create_task(_persist_reaction())
+        live = LiveOutput(ctx, syntax=runtime.language)
 
-        async with ctx.typing():
-            output: PistonResponse = await ctx.bot.piston.execute(runtime, [file])
+        try:
+            async with ctx.typing(), ctx.scheduled():
+                output: PistonResponse = await ctx.bot.piston.execute(runtime, [file], on_output=live.feed)
+        except (*PISTON_UNAVAILABLE_ERRORS, PistonHTTPException) as exc:
+            if not _piston_unavailable(exc):
+                raise
+
+            language = await ctx.bot.tio.find_language((runtime.language, *runtime.aliases))
+            if language is None:
+                raise
 
-        if not task.done():
-            task.cancel()
+            return await self._run_on_tio(ctx, code, language, live=live)
+        finally:
+            if not task.done():
+                task.cancel()
 
         # Compile-time errors get a warning reaction
         if output.compile_output and output.compile_output.code != 0:
@@ -100,8 +158,50 @@ class OtherCommands(Cog, name='Other'):
 
         ctx.bot.loop.create_task(ctx.try_reaction(reaction))
 
-        fmt = f'{output.output}\n\nExit code: {output.code}'
-        await send_output(ctx, fmt, syntax=runtime.language)
+        fmt = Output.of(output.parts, f'\n\nExit code: {output.code}')
+        await live.finish(fmt)
+
+    @commands.command('run-many', aliases=['runmany', 'compare', 'exec-many'])
+    @commands.cooldown(1, 15, commands.BucketType.user)
+    @commands.max_concurrency(1, commands.BucketType.user)
+    @requires('http')
+    async def run_many(
+        self,
+        ctx: Context,
+        runtimes: commands.Greedy[PistonRuntimeConverter],
+        *,
+        code: codeblock_converter = None
+    ) -> None:
+        """Executes the given code with each of the given runtimes, and compares the outputs.
+
+        Code can be supplied in the same ways as with `{PREFIX}run`.
+        """
+        # Runtimes aren't hashable as their aliases are a list
+        runtimes: list[PistonRuntime] = list({(rt.language, rt.version): rt for rt in runtimes}.values())
+
+        if len(runtimes) < 2:
+            raise commands.BadArgument('Please give at least two runtimes to compare.')
+
+        if len(runtimes) > MAX_BATCH_RUNTIMES:
+            raise commands.BadArgument(f'At most {MAX_BATCH_RUNTIMES} runtimes can be compared at once.')
+
+        code: str = await get_code(ctx, code)
+
+        async with ctx.typing(), ctx.scheduled():
+            responses = await ctx.bot.piston.execute_many(
+                (runtime, [PistonFile(f'run.{runtime.language}', code)]) for runtime in runtimes
+            )
+
+        entries = []
+        for runtime, response in zip(runtimes, responses):
+            label = f'{runtime.language} {runtime.version}'
+
+            if isinstance(response, Exception):
+                entries.append(BatchEntry(label, '', f'error: {response}'))
+            else:
+                entries.append(BatchEntry(label, response.output, f'exit code {response.code}'))
+
+        await send_output(ctx, Output(*render_report(entries)), syntax='diff')
 
 
 def setup(bot: RustPy) -> None:
@@ -3,8 +3,11 @@ import asyncio
 from discord.ext import commands
 from jishaku.codeblocks import codeblock_converter
 
+from rustpy.constants import RustChannel
 from rustpy.core import Cog, Context, RustPy
-from rustpy.helpers.common import get_code, send_output
+from rustpy.core.startup import requires
+from rustpy.helpers.batch import BatchEntry, render_report
+from rustpy.helpers.common import Output, get_code, send_output
 
 
 class RustCommands(Cog, name='Rust'):
@@ -13,6 +16,7 @@ class RustCommands(Cog, name='Rust'):
     @commands.command('rust', aliases=('rs', 'ferris'))
     @commands.cooldown(2, 7, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
+    @requires('http', 'database')
     async def run_rust(self, ctx: Context, *, code: codeblock_converter = None) -> None:
         """Compiles and runs a rust program.
 
@@ -20,7 +24,8 @@ class RustCommands(Cog, name='Rust'):
         Behavior of this command can be configured through `{RPEFIX}settings rust`.
         """
         code = await get_code(ctx, code)
-        settings = await ctx.db.get_settings(ctx.author.id)
+        with ctx.phase('settings'):
+            settings = await ctx.db.get_settings(ctx.author.id)
 
         async def _persist_reaction():
             await asyncio.sleep(14)
@@ -28,7 +33,7 @@ class RustCommands(Cog, name='Rust'):
 
         task = ctx.bot.loop.create_task(_persist_reaction())
 
-        async with ctx.typing():
+        async with ctx.typing(), ctx.scheduled():
             response = await ctx.bot.rust.execute(
                 code,
                 channel=settings.rust_channel,
@@ -42,13 +47,47 @@ class RustCommands(Cog, name='Rust'):
         reaction = '\U0001f44d' if response.success else '\u274c'
         ctx.bot.loop.create_task(ctx.try_reaction(reaction))
 
-        await send_output(ctx, str(response), syntax='rs')
+        await send_output(ctx, Output(*response.parts), syntax='rs')
+
+    @commands.command('rust-compare', aliases=('rustcompare', 'rscompare', 'rust-channels', 'rustchannels'))
+    @commands.cooldown(1, 15, commands.BucketType.user)
+    @commands.max_concurrency(1, commands.BucketType.user)
+    @requires('http', 'database')
+    async def rust_compare(self, ctx: Context, *, code: codeblock_converter = None) -> None:
+        """Compiles and runs a rust program on the stable, beta and nightly channels, and compares the outputs.
+
+        See `{PREFIX}help eval` on information on supplying code.
+        The edition and mode used can be configured through `{PREFIX}settings rust`.
+        """
+        code = await get_code(ctx, code)
+        with ctx.phase('settings'):
+            settings = await ctx.db.get_settings(ctx.author.id)
+        channels = list(RustChannel)
+
+        async with ctx.typing(), ctx.scheduled():
+            responses = await ctx.bot.rust.execute_many(
+                dict(code=code, channel=channel, edition=settings.rust_edition, mode=settings.rust_mode)
+                for channel in channels
+            )
+
+        entries = []
+        for channel, response in zip(channels, responses):
+            if isinstance(response, Exception):
+                entries.append(BatchEntry(channel.name.lower(), '', f'error: {response}'))
+            else:
+                entries.append(BatchEntry(channel.name.lower(), str(response), 'ok' if response.success else 'failed'))
+
+        reaction = '\U0001f44d' if all(entry.status == 'ok' for entry in entries) else '\u274c'
+        ctx.bot.loop.create_task(ctx.try_reaction(reaction))
+
+        await send_output(ctx, Output(*render_report(entries)), syntax='diff')
 
     _rustfmt_aliases = 'rust-format', 'rsformat', 'rsfmt', 'rfmt', 'cargo-fmt', 'cargofmt'
 
     @commands.command('rustfmt', aliases=_rustfmt_aliases)
     @commands.cooldown(2, 7, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
+    @requires('http', 'database')
     async def rustfmt(self, ctx: Context, *, code: codeblock_converter = None) -> None:
         """Formats the given Rust code using `cargo fmt`.
 
@@ -56,15 +95,16 @@ class RustCommands(Cog, name='Rust'):
         Behavior of this command can be configured through `{PREFIX}settings rust`.
         """
         code = await get_code(ctx, code)
-        settings = await ctx.db.get_settings(ctx.author.id)
+        with ctx.phase('settings'):
+            settings = await ctx.db.get_settings(ctx.author.id)
 
-        async with ctx.typing():
+        async with ctx.typing(), ctx.scheduled():
             response = await ctx.bot.rust.format(code, edition=settings.rust_edition)
 
         reaction = '\U0001f44d' if response.success else '\u274c'
         ctx.bot.loop.create_task(ctx.try_reaction(reaction))
 
-        await send_output(ctx, str(response), syntax='rs')
+        await send_output(ctx, Output(*response.parts), syntax='rs')
 
     _expand_macros_aliases = (
         'expandmacros',
@@ -79,6 +119,7 @@ class RustCommands(Cog, name='Rust'):
     @commands.command('expand-macros', aliases=_expand_macros_aliases)
     @commands.cooldown(2, 7, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
+    @requires('http', 'database')
     async def expand_macros(self, ctx: Context, *, code: codeblock_converter = None) -> None:
         """Expands all Rust macros in the given code.
 
@@ -86,15 +127,16 @@ class RustCommands(Cog, name='Rust'):
         Behavior of this command can be configured through `{PREFIX}settings rust`.
         """
         code = await get_code(ctx, code)
-        settings = await ctx.db.get_settings(ctx.author.id)
+        with ctx.phase('settings'):
+            settings = await ctx.db.get_settings(ctx.author.id)
 
-        async with ctx.typing():
+        async with ctx.typing(), ctx.scheduled():
             response = await ctx.bot.rust.expand_macros(code, edition=settings.rust_edition)
 
         reaction = '\U0001f44d' if response.success else '\u274c'
         ctx.bot.loop.create_task(ctx.try_reaction(reaction))
 
-        await send_output(ctx, str(response), syntax='rs')
+        await send_output(ctx, Output(*response.parts), syntax='rs')
 
 
 def setup(bot: RustPy) -> None:
@@ -1,4 +1,5 @@
 from .mystbin import *
+from .paste import *
 from .piston import *
 from .rust import *
 from .tio import *
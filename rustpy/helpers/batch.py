@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import difflib
+
+from typing import Awaitable, Callable, Iterable, NamedTuple, TypeVar, Union
+
+__all__ = (
+    'BatchEntry',
+    'gather_bounded',
+    'render_report',
+)
+
+T = TypeVar('T')
+
+# Outputs with more lines than this are shown in full rather than diffed, diffing them would take too long
+MAX_DIFF_LINES = 2000
+
+
+async def gather_bounded(factories: Iterable[Callable[[], Awaitable[T]]], *, limit: int) -> list[Union[T, Exception]]:
+    """Runs the awaitables made by ``factories`` with at most ``limit`` of them running at once.
+
+    Results are in the same order as the factories, and an awaitable which raised gives its exception.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(factory: Callable[[], Awaitable[T]]) -> T:
+        async with semaphore:
+            return await factory()
+
+    return await asyncio.gather(*map(run, factories), return_exceptions=True)
+
+
+class BatchEntry(NamedTuple):
+    label: str  # E.g. the runtime or channel the job ran with
+    output: str
+    status: str  # E.g. "exit code 0", or the error if the job failed
+
+
+def _diff(base: BatchEntry, labels: str, entry: BatchEntry) -> Iterable[str]:
+    a = base.output.splitlines(keepends=True)
+    b = entry.output.splitlines(keepends=True)
+
+    if len(a) > MAX_DIFF_LINES or len(b) > MAX_DIFF_LINES:
+        yield entry.output
+        return
+
+    for line in difflib.unified_diff(a, b, fromfile=base.label, tofile=labels):
+        yield line if line.endswith('\n') else line + '\n\\ No newline at end of file\n'
+
+
+def render_report(entries: Iterable[BatchEntry]) -> list[str]:
+    """Renders the results of a batch as one report, returning the pieces it is made of.
+
+    Jobs with the same output and status are grouped together. The first group with any output
+    is shown in full and every other group as a unified diff against it, so that differences stand out.
+    """
+    groups: dict[tuple[str, str], list[BatchEntry]] = {}
+    for entry in entries:
+        groups.setdefault((entry.output, entry.status), []).append(entry)
+
+    parts = []
+    base = None
+
+    for group in groups.values():
+        entry = group[0]
+        labels = ', '.join(member.label for member in group)
+
+        if parts:
+            parts.append('\n')
+
+        if not entry.output:
+            # Usually a job which failed, there's nothing to compare
+            parts.append(f'== {labels} ({entry.status}) ==\n')
+        elif base is None:
+            base = entry
+            parts += f'== {labels} ({entry.status}) ==\n', entry.output
+
+            if not entry.output.endswith('\n'):
+                parts.append('\n')
+        elif entry.output == base.output:
+            parts.append(f'== {labels} ({entry.status}) ==\nSame output as {base.label}\n')
+        else:
+            parts.append(f'== {labels} ({entry.status}) ==\n')
+            parts += _diff(base, labels, entry)
+
+    return parts
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import time
+
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+
+from typing import AsyncIterator, Type
+
+__all__ = (
+    'CircuitBreaker',
+    'CircuitOpen',
+    'CircuitState',
+)
+
+
+class CircuitState(Enum):
+    CLOSED    = 0
+    OPEN      = 1
+    HALF_OPEN = 2
+
+
+class CircuitBreaker:
+    """Stops sending requests to a backend which is failing or too slow.
+
+    Outcomes of the requests made in the last ``window`` seconds are tracked. Once at least
+    ``min_requests`` were made and the share of failed ones (slow requests count as failed)
+    reaches ``failure_threshold``, the circuit opens and requests fail immediately with
+    :class:`CircuitOpen`. After ``reset_timeout`` seconds a single trial request is let through,
+    closing the circuit again if it succeeds.
+
+    Errors in ``excluded`` count as successes, and only errors in ``failures`` count as failures.
+    Other errors aren't recorded at all.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: float = 0.5,
+        min_requests: int = 5,
+        window: float = 60.0,
+        slow_threshold: float = 20.0,
+        reset_timeout: float = 30.0,
+        excluded: tuple[Type[BaseException], ...] = (),
+        failures: tuple[Type[BaseException], ...] = (Exception,),
+    ) -> None:
+        self.name: str = name
+        self.failure_threshold: float = failure_threshold
+        self.min_requests: int = min_requests
+        self.window: float = window
+        self.slow_threshold: float = slow_threshold
+        self.reset_timeout: float = reset_timeout
+        self.excluded: tuple[Type[BaseException], ...] = excluded
+        self.failures: tuple[Type[BaseException], ...] = failures
+
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._opened_at: float = 0.0
+        self._state: CircuitState = CircuitState.CLOSED
+        self._trial_running: bool = False
+        # Bumped whenever the circuit opens, so that requests made before then can be told apart
+        self._generation: int = 0
+
+    def __repr__(self) -> str:
+        return f'<CircuitBreaker name={self.name!r} state={self.state.name} failure_rate={self.failure_rate:.2f}>'
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state is CircuitState.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = CircuitState.HALF_OPEN
+
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """Whether requests would currently be rejected."""
+        state = self.state
+        return state is CircuitState.OPEN or state is CircuitState.HALF_OPEN and self._trial_running
+
+    @property
+    def retry_after(self) -> float:
+        return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    @property
+    def failure_rate(self) -> float:
+        self._trim(time.monotonic())
+        if not self._outcomes:
+            return 0.0
+
+        return sum(failed for _, failed in self._outcomes) / len(self._outcomes)
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _open(self) -> None:
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._generation += 1
+
+    def record(self, *, failed: bool, latency: float = 0.0) -> None:
+        failed = failed or latency >= self.slow_threshold
+
+        if self._state is CircuitState.HALF_OPEN:
+            self._trial_running = False
+
+            if failed:
+                return self._open()
+
+            self._state = CircuitState.CLOSED
+
+        now = time.monotonic()
+        self._outcomes.append((now, failed))
+        self._trim(now)
+
+        if len(self._outcomes) >= self.min_requests and self.failure_rate >= self.failure_threshold:
+            self._open()
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        if self.is_open:
+            raise CircuitOpen(self)
+
+        if trial := self.state is CircuitState.HALF_OPEN:
+            self._trial_running = True
+
+        generation = self._generation
+        start = time.perf_counter()
+
+        def finish(failed: bool) -> None:
+            # Requests which were already running when the circuit opened don't say anything about the backend now
+            if self._generation == generation:
+                self.record(failed=failed, latency=time.perf_counter() - start)
+
+        try:
+            yield
+        except self.excluded:
+            finish(False)
+            raise
+        except self.failures:
+            finish(True)
+            raise
+        except BaseException:  # Cancelled or not counted, the trial request didn't tell us anything
+            if trial:
+                self._trial_running = False
+            raise
+        else:
+            finish(False)
+
+
+class CircuitOpen(Exception):
+    """Raised when a request is rejected because a backend's circuit breaker is open."""
+
+    def __init__(self, breaker: CircuitBreaker) -> None:
+        self.breaker: CircuitBreaker = breaker
+        super().__init__(
+            f'{breaker.name} is currently unavailable, please try again in {breaker.retry_after:.0f} seconds.'
+        )
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+__all__ = (
+    'CacheStats',
+    'LRUCache',
+    'ResultCache',
+    'payload_hash',
+)
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+_MISSING = object()
+
+
+def payload_hash(*parts: Any) -> str:
+    """Returns a stable SHA-256 hex digest of the given JSON-serializable parts."""
+    raw = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class CacheStats:
+    """Hit/miss counters of a cache."""
+
+    __slots__ = ('hits', 'misses', 'evictions')
+
+    def __init__(self) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __repr__(self) -> str:
+        return f'<CacheStats hits={self.hits} misses={self.misses} evictions={self.evictions}>'
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LRUCache(Generic[K, V]):
+    """A bounded mapping which evicts the least recently used entries first.
+
+    If ``ttl`` is given, entries also expire that many seconds after they were set.
+    """
+
+    def __init__(self, maxsize: int = 1024, *, ttl: Optional[float] = None) -> None:
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive.')
+
+        self.maxsize: int = maxsize
+        self.ttl: Optional[float] = ttl
+        self.stats: CacheStats = CacheStats()
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__} size={len(self._data)} maxsize={self.maxsize} ttl={self.ttl}>'
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key, _MISSING, record=False) is not _MISSING
+
+    def get(self, key: K, default: Any = None, *, record: bool = True) -> Any:
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            if record:
+                self.stats.misses += 1
+            return default
+
+        if expires_at and expires_at < time.monotonic():
+            del self._data[key]
+            if record:
+                self.stats.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        if record:
+            self.stats.hits += 1
+        return value
+
+    def set(self, key: K, value: V, *, ttl: Optional[float] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        self._data[key] = (time.monotonic() + ttl if ttl else 0.0, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def pop(self, key: K, default: Any = None) -> Any:
+        try:
+            return self._data.pop(key)[1]
+        except KeyError:
+            return default
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class ResultCache:
+    """A content-addressed cache of JSON-serializable upstream results.
+
+    Results are kept in a bounded in-memory :class:`LRUCache`. If ``directory`` is given,
+    they are also written to disk there so that they survive restarts and memory evictions.
+    """
+
+    def __init__(
+        self,
+        *,
+        maxsize: int = 512,
+        ttl: Optional[float] = 3600.0,
+        directory: Optional[str] = None,
+    ) -> None:
+        self.memory: LRUCache[str, Any] = LRUCache(maxsize, ttl=ttl)
+        self.directory: Optional[str] = directory
+        self.stats: CacheStats = CacheStats()
+
+    def __repr__(self) -> str:
+        return f'<ResultCache memory={self.memory!r} directory={self.directory!r} stats={self.stats!r}>'
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def _read(self, key: str) -> Any:
+        path = self._path(key)
+        try:
+            if self.memory.ttl and time.time() - os.path.getmtime(path) > self.memory.ttl:
+                os.remove(path)
+                return _MISSING
+
+            with open(path, encoding='utf-8') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return _MISSING
+
+    def _write(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w', encoding='utf-8') as fp:
+            json.dump(value, fp)
+
+        os.replace(temp, path)
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+
+        if value is _MISSING and self.directory:
+            value = await asyncio.to_thread(self._read, key)
+            if value is not _MISSING:
+                self.memory.set(key, value)
+
+        if value is _MISSING:
+            self.stats.misses += 1
+            return default
+
+        self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._write, key, value)
+            except OSError:
+                pass  # The disk tier is best-effort
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+
+from rustpy.helpers.singleflight import SingleFlight
+from typing import Any, Callable, Generic, Optional, TypeVar, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rustpy.helpers.http import UpstreamHTTP
+
+__all__ = (
+    'Catalog',
+    'CatalogUnavailable',
+)
+
+T = TypeVar('T')
+
+
+class Catalog(Generic[T]):
+    """A catalog fetched from an upstream API, e.g. the runtimes Piston supports.
+
+    The raw catalog is turned into an index through ``build`` once per fetch, so that lookups
+    don't have to scan it. It is snapshotted to ``snapshot_path`` so that restarts don't depend on
+    the upstream being reachable, and refreshed in the background with conditional requests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        http: Callable[[], UpstreamHTTP],
+        url: Callable[[], str],
+        build: Callable[[Any], T],
+        snapshot_path: Optional[str] = None,
+        refresh_interval: float = 3600.0,
+    ) -> None:
+        self.name: str = name
+        self.snapshot_path: Optional[str] = snapshot_path
+        self.refresh_interval: float = refresh_interval
+
+        self._http: Callable[[], UpstreamHTTP] = http
+        self._url: Callable[[], str] = url
+        self._build: Callable[[Any], T] = build
+
+        self._index: Optional[T] = None
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._fetched_at: float = 0.0
+
+        self._inflight: SingleFlight[T] = SingleFlight()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return f'<Catalog name={self.name!r} loaded={self._index is not None} etag={self._etag!r}>'
+
+    @property
+    def index(self) -> Optional[T]:
+        """The index, if it was loaded already."""
+        return self._index
+
+    def _read_snapshot(self) -> Optional[dict[str, Any]]:
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def _write_snapshot(self, data: Any) -> None:
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+
+        temp = self.snapshot_path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as fp:
+            json.dump({
+                'etag': self._etag,
+                'last_modified': self._last_modified,
+                'fetched_at': self._fetched_at,
+                'data': data,
+            }, fp)
+
+        os.replace(temp, self.snapshot_path)
+
+    async def _load_snapshot(self) -> bool:
+        if not self.snapshot_path or not (snapshot := await asyncio.to_thread(self._read_snapshot)):
+            return False
+
+        self._index = self._build(snapshot['data'])
+        self._etag = snapshot.get('etag')
+        self._last_modified = snapshot.get('last_modified')
+        self._fetched_at = snapshot.get('fetched_at', 0.0)
+        return True
+
+    async def _refresh(self) -> T:
+        headers = {}
+        if self._index is not None:
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+
+        async with self._http().get(self._url(), headers=headers) as response:
+            if response.status == 304:
+                self._fetched_at = time.time()
+                return self._index
+
+            if not response.ok:
+                raise CatalogUnavailable(self.name, f'{response.status} {response.reason}')
+
+            data = await response.json(encoding='utf-8')
+            self._etag = response.headers.get('ETag')
+            self._last_modified = response.headers.get('Last-Modified')
+
+        self._index = index = self._build(data)
+        self._fetched_at = time.time()
+
+        if self.snapshot_path:
+            try:
+                await asyncio.to_thread(self._write_snapshot, data)
+            except OSError:
+                pass  # The snapshot is best-effort
+
+        return index
+
+    async def refresh(self) -> T:
+        """Fetches the catalog if it changed upstream, returning the up to date index."""
+        return await self._inflight.do('refresh', self._refresh)
+
+    async def get(self) -> T:
+        if self._index is not None:
+            return self._index
+
+        if await self._load_snapshot():
+            return self._index
+
+        return await self.refresh()
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            # A snapshot may be old already, so don't wait a whole interval after a restart
+            stale_in = self._fetched_at + self.refresh_interval - time.time()
+            await asyncio.sleep(max(stale_in, 0.0))
+
+            try:
+                await self.refresh()
+            except Exception:
+                await asyncio.sleep(60)  # Keep serving what we have, try again soon
+
+    def start(self) -> None:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+class CatalogUnavailable(Exception):
+    """Raised when a catalog couldn't be fetched and no snapshot of it exists."""
+
+    def __init__(self, name: str, reason: str) -> None:
+        self.name: str = name
+        super().__init__(f'Could not fetch the {name} catalog: {reason}')
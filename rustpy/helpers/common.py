@@ -1,21 +1,30 @@
 from __future__ import annotations
 
+import asyncio
 import copy
+import io
+import logging
 import re
 
 import discord
 from discord.ext.commands import BadArgument
 
 from jishaku.codeblocks import Codeblock
-from typing import Union, TYPE_CHECKING
+from rustpy.helpers.paste import PasteUnavailable
+from typing import Iterable, Optional, Union, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from rustpy.core import Context
 
 __all__ = (
+    'LiveOutput',
+    'Output',
     'get_code',
+    'send_output',
 )
 
+log = logging.getLogger(__name__)
+
 CODEBLOCK_REGEX: re.Pattern[str] = re.compile(
     r'\s*```((?P<language>[a-zA-Z0-9]+)\s*\n)?(?P<code>.+)```',
     re.S
@@ -25,8 +34,18 @@ MYSTBIN_REGEX: re.Pattern[str] = re.compile(
     r'https?://mystb.in/(?P<code>[A-Za-z]{3,64})(\.(?P<syntax>[A-Za-z0-9]+))?/?'
 )
 
+# Output longer than this is uploaded to a paste service rather than sent in a codeblock
+MAX_INLINE_CHARACTERS = 1986
+MAX_INLINE_LINES = 50
 
-async def get_code(ctx: Context, code: Union[Codeblock, str, None] = None) -> str:
+# Discord rejects messages longer than this
+MAX_MESSAGE_CHARACTERS = 2000
+
+# Seconds between edits of a message showing live output, Discord allows 5 edits every 5 seconds
+LIVE_EDIT_INTERVAL = 1.5
+
+
+async def _get_code(ctx: Context, code: Union[Codeblock, str, None] = None) -> str:
     if code is not None:
         if isinstance(code, Codeblock):
             code = code.content
@@ -45,7 +64,8 @@ async def get_code(ctx: Context, code: Union[Codeblock, str, None] = None) -> st
 
             raw = await target.read()
             try:
-                code = raw.decode('utf-8')  # Maybe errors='ignore' here but not sure if that's safe
+                # Maybe errors='ignore' here but not sure if that's safe
+                code = await ctx.bot.offload.run(raw.decode, 'utf-8', size=len(raw))
             except UnicodeDecodeError:
                 raise BadArgument('Attachment does not have readable code.')
             else:
@@ -55,26 +75,171 @@ async def get_code(ctx: Context, code: Union[Codeblock, str, None] = None) -> st
             if resolved := reference.resolved:
                 if match := CODEBLOCK_REGEX.search(resolved.content):
                     _, language, code = match.groups()
-                    return await get_code(
+                    return await _get_code(
                         ctx,
                         Codeblock(language, code.strip('\n'))
                     )
 
                 ctx_clone = copy.copy(ctx)
                 ctx_clone.message = resolved
-                return await get_code(ctx_clone, code)
+                return await _get_code(ctx_clone, code)
 
         raise BadArgument('Please supply a block of code.')
 
     return code
 
 
-async def send_output(ctx: Context, output: str, **kwargs) -> discord.Message:
+class Output:
+    """The output of a program, kept as the pieces it is made of.
+
+    Outputs can be megabytes long, so they are only joined into one string when they are
+    uploaded. Whether they fit in a message is decided from their length before any of them is scanned.
+    """
+
+    __slots__ = ('parts', '_length')
+
+    def __init__(self, *parts: str) -> None:
+        self.parts: tuple[str, ...] = parts
+        self._length: int = sum(map(len, parts))
+
+    @classmethod
+    def of(cls, parts: Iterable[str], *extra: str) -> Output:
+        return cls(*parts, *extra)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __str__(self) -> str:
+        return ''.join(self.parts)
+
+    def __repr__(self) -> str:
+        return f'<Output parts={len(self.parts)} length={self._length}>'
+
+    def inline(self, max_characters: int = MAX_INLINE_CHARACTERS, max_lines: int = MAX_INLINE_LINES) -> Optional[str]:
+        """Returns the output escaped for a codeblock, or ``None`` if it doesn't fit in one."""
+        if self._length > max_characters:
+            return None
+
+        output = str(self)
+        if output.count('\n') > max_lines:
+            return None
+
+        sanitized_output = output.replace('```', '`\u200b``')
+        if len(sanitized_output) > max_characters:
+            return None
+
+        return sanitized_output
+
+
+async def get_code(ctx: Context, code: Union[Codeblock, str, None] = None) -> str:
+    with ctx.phase('get_code'):
+        return await _get_code(ctx, code)
+
+
+def _codeblock_budget(syntax: str) -> int:
+    """Returns how many characters of output fit in a codeblock with the given syntax."""
+    return min(MAX_INLINE_CHARACTERS, MAX_MESSAGE_CHARACTERS - len(f'```{syntax}\n```'))
+
+
+async def _render_output(ctx: Context, output: Output, syntax: str) -> tuple[str, Optional[discord.File]]:
+    if (sanitized_output := output.inline(_codeblock_budget(syntax))) is not None:
+        return f'```{syntax}\n{sanitized_output}```', None
+
+    content = str(output)
+    try:
+        url = await ctx.bot.pastes.upload(content, syntax=syntax)
+    except PasteUnavailable:
+        file = discord.File(io.BytesIO(content.encode('utf-8')), filename=f'output.{syntax}')
+        return 'Output is attached, as no paste service is available right now.', file
+
+    return f'Output can be viewed at <{url}>', None
+
+
+async def send_output(ctx: Context, output: Union[Output, str], **kwargs) -> discord.Message:
     syntax = kwargs.pop('syntax', 'txt')
-    sanitized_output = output.replace('```', '`\u200b``')
 
-    if len(sanitized_output) > 1986 or output.count('\n') > 50:
-        paste = await ctx.bot.mystbin.create_paste(output, syntax=syntax)
-        return await ctx.send(f'Output can be viewed at <{paste.url}>', **kwargs)
+    if isinstance(output, str):
+        output = Output(output)
+
+    with ctx.phase('send_output'):
+        content, file = await _render_output(ctx, output, syntax)
+        return await ctx.send(content, file=file, **kwargs)
+
+
+class LiveOutput:
+    """Shows the output of a program in one message while it is still running.
+
+    Pass :meth:`feed` as the callback receiving output, the message is sent as soon as there's
+    any and then edited at most every ``interval`` seconds with the latest lines. :meth:`finish`
+    replaces it with the final output, or sends that normally if the program printed nothing.
+    """
+
+    def __init__(self, ctx: Context, *, syntax: str = 'txt', interval: float = LIVE_EDIT_INTERVAL) -> None:
+        self.ctx: Context = ctx
+        self.syntax: str = syntax
+        self.interval: float = interval
+        self.message: Optional[discord.Message] = None
+
+        self._tail: str = ''
+        self._dirty: bool = False
+        self._sending: Optional[asyncio.Future[discord.Message]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def feed(self, data: str) -> None:
+        # Only the end of the output is ever shown, so that's all which is kept
+        self._tail = (self._tail + data)[-_codeblock_budget(self.syntax):]
+        self._dirty = True
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._update())
+
+    def _render(self) -> str:
+        lines = self._tail.split('\n')[-MAX_INLINE_LINES:]
+        sanitized_output = '\n'.join(lines).replace('```', '`\u200b``')[-_codeblock_budget(self.syntax):]
+        return f'```{self.syntax}\n{sanitized_output}```'
+
+    async def _update(self) -> None:
+        while self._dirty:
+            self._dirty = False
+            content = self._render()
+
+            try:
+                if self.message is None:
+                    # Shielded, so that finish() doesn't lose track of a message which is being sent
+                    self._sending = asyncio.ensure_future(self.ctx.send(content))
+                    self.message = await asyncio.shield(self._sending)
+                else:
+                    await self.message.edit(content=content)
+            except discord.HTTPException as exc:
+                # The final output replaces this anyway, so keep going
+                log.warning('Could not update live output: %s', exc)
+
+            await asyncio.sleep(self.interval)
+
+        self._task = None
+
+    async def finish(self, output: Union[Output, str]) -> discord.Message:
+        if self._task is not None:
+            self._task.cancel()
+
+        if self.message is None and self._sending is not None:
+            try:
+                self.message = await self._sending
+            except discord.HTTPException:
+                pass
+
+        if self.message is None:
+            return await send_output(self.ctx, output, syntax=self.syntax)
+
+        if isinstance(output, str):
+            output = Output(output)
+
+        with self.ctx.phase('send_output'):
+            content, file = await _render_output(self.ctx, output, self.syntax)
+
+            if file is None:
+                await self.message.edit(content=content)
+            else:
+                await self.message.edit(content=content, attachments=[file])
 
-    return await ctx.send(f'```{syntax}\n{sanitized_output}```')
+        return self.message
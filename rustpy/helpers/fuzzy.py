@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import bisect
+
+from collections import defaultdict
+from rustpy.helpers.cache import LRUCache
+from typing import Iterable, Optional
+
+__all__ = (
+    'FuzzyIndex',
+    'edit_distance',
+)
+
+
+def edit_distance(a: str, b: str, /, limit: Optional[int] = None) -> int:
+    """The optimal string alignment distance between two strings.
+
+    This is the Levenshtein distance, except swapping two adjacent characters
+    counts as one edit rather than two, since that is a very common typo.
+
+    If ``limit`` is given, ``limit + 1`` is returned as soon as the distance is known to exceed it.
+    """
+    if a == b:
+        return 0
+
+    if limit is not None and abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    if not a or not b:
+        return len(a) or len(b)
+
+    previous2: Optional[list[int]] = None
+    previous = list(range(len(b) + 1))
+
+    for i, ca in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+
+        for j, cb in enumerate(b, start=1):
+            cost = ca != cb
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+
+            if previous2 is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+
+        if limit is not None and min(current) > limit:
+            return limit + 1
+
+        previous2, previous = previous, current
+
+    return previous[-1] if limit is None else min(previous[-1], limit + 1)
+
+
+def _bigrams(word: str) -> frozenset[str]:
+    word = f'^{word}$'
+    return frozenset(word[i:i + 2] for i in range(len(word) - 1))
+
+
+class FuzzyIndex:
+    """Finds the words closest to a query through an index of their bigrams.
+
+    One edit changes at most three of a word's bigrams, so a word within ``k`` edits of the query
+    has to share most of its bigrams with it. Counting shared bigrams through the index rules out
+    almost every word before any edit distance has to be computed.
+
+    Results are memoized so that the same typo only costs a lookup the next time, and words the
+    query is a prefix of are suggested after the close matches.
+    """
+
+    # The most bigrams a single edit can change (a transposition)
+    BIGRAMS_PER_EDIT = 3
+
+    def __init__(self, words: Iterable[str], *, cache_size: int = 1024) -> None:
+        self._words: list[str] = []
+        self._bigram_counts: list[int] = []
+        self._postings: defaultdict[str, list[int]] = defaultdict(list)
+        self._by_length: defaultdict[int, list[int]] = defaultdict(list)
+
+        self._sorted: list[str] = []
+        self._cache: LRUCache[tuple[str, int], list[str]] = LRUCache(cache_size)
+
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def add(self, word: str) -> None:
+        word = word.lower()
+
+        position = bisect.bisect_left(self._sorted, word)
+        if position < len(self._sorted) and self._sorted[position] == word:
+            return
+
+        self._sorted.insert(position, word)
+
+        i = len(self._words)
+        bigrams = _bigrams(word)
+
+        self._words.append(word)
+        self._bigram_counts.append(len(bigrams))
+        self._by_length[len(word)].append(i)
+
+        for bigram in bigrams:
+            self._postings[bigram].append(i)
+
+        self._cache.clear()
+
+    def _search(self, query: str, max_distance: int) -> list[tuple[int, str]]:
+        bigrams = _bigrams(query)
+        allowed_loss = self.BIGRAMS_PER_EDIT * max_distance
+
+        shared: defaultdict[int, int] = defaultdict(int)
+        for bigram in bigrams:
+            for i in self._postings.get(bigram, ()):
+                shared[i] += 1
+
+        # Very short words can be close enough without sharing any bigram at all
+        if len(bigrams) <= allowed_loss:
+            for length in range(len(query) - max_distance, len(query) + max_distance + 1):
+                for i in self._by_length.get(length, ()):
+                    shared.setdefault(i, 0)
+
+        results = []
+        for i, count in shared.items():
+            if count < max(len(bigrams), self._bigram_counts[i]) - allowed_loss:
+                continue
+
+            word = self._words[i]
+            if (distance := edit_distance(query, word, max_distance)) <= max_distance:
+                results.append((distance, word))
+
+        return results
+
+    def suggest(self, query: str, *, limit: int = 10, max_distance: Optional[int] = None) -> list[str]:
+        """Returns up to ``limit`` words closest to the query, closest first."""
+        query = query.lower()
+
+        # Roughly one typo every three characters, so that short queries don't match everything
+        if max_distance is None:
+            max_distance = max(1, min(3, len(query) // 3))
+
+        key = query, max_distance
+        if (cached := self._cache.get(key)) is None:
+            matches = self._search(query, max_distance)
+            matches.sort(key=lambda match: (match[0], not match[1].startswith(query[:1]), match[1]))
+
+            cached = [word for _, word in matches]
+
+            start = bisect.bisect_left(self._sorted, query)
+            end = bisect.bisect_left(self._sorted, query + '\U0010ffff', lo=start)
+            cached += [word for word in self._sorted[start:end] if word not in cached]
+
+            self._cache.set(key, cached)
+
+        return cached[:limit]
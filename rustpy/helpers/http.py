@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from rustpy.core.metrics import UPSTREAM_BYTES, UPSTREAM_ERRORS, UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+
+from typing import Any, AsyncIterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from aiohttp import ClientResponse, ClientSession, ClientWebSocketResponse
+    from multidict import CIMultiDictProxy
+
+__all__ = (
+    'TokenBucket',
+    'UpstreamHTTP',
+    'UpstreamRateLimited',
+    'ResponseTooLarge',
+    'read_limited',
+)
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+# A 429 means the request was never processed, so it can always be retried.
+# Other statuses are only retried for idempotent requests.
+ALWAYS_RETRY_STATUSES = frozenset({429})
+IDEMPOTENT_RETRY_STATUSES = frozenset({502, 503, 504})
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second on average, with bursts of up to ``capacity`` requests."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate: float = rate
+        self.capacity: int = capacity
+
+        self._tokens: float = capacity
+        self._updated: float = time.monotonic()
+        self._blocked_until: float = 0.0
+
+    def __repr__(self) -> str:
+        return f'<TokenBucket rate={self.rate} capacity={self.capacity} tokens={self._tokens:.2f}>'
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds to wait before it may be used."""
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens -= 1
+
+        delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(delay, self._blocked_until - now)
+
+    def cancel(self) -> None:
+        """Gives back a token taken by :meth:`reserve` that won't be used."""
+        self._tokens += 1
+
+    def block(self, seconds: float) -> None:
+        """Stops handing out usable tokens for the given amount of seconds."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def update(self, remaining: int, reset_after: float) -> None:
+        """Syncs this bucket with the upstream's own rate limit counters."""
+        self._refill(time.monotonic())
+        self._tokens = min(self._tokens, remaining)
+
+        if remaining <= 0:
+            self.block(reset_after)
+
+
+def _parse_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:  # Retry-After may also be an HTTP date
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_reset(headers: CIMultiDictProxy[str]) -> Optional[float]:
+    if (reset_after := _parse_seconds(headers.get('X-RateLimit-Reset-After'))) is not None:
+        return reset_after
+
+    if (reset := _parse_seconds(headers.get('RateLimit-Reset') or headers.get('X-RateLimit-Reset'))) is not None:
+        # Some APIs send a UNIX timestamp here rather than an amount of seconds
+        return max(reset - time.time(), 0.0) if reset > 1e9 else reset
+
+    return None
+
+
+class UpstreamHTTP:
+    """Makes rate limited requests to upstream APIs.
+
+    Every upstream host gets its own :class:`TokenBucket`, which is kept in sync with the
+    ``Retry-After`` and rate limit headers the host sends back. Requests that would exceed the
+    limit are delayed instead of being sent, and rate limited or failed requests are retried
+    with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        *,
+        rate_limits: dict[str, tuple[float, int]] = None,
+        default_rate_limit: tuple[float, int] = (10.0, 10),
+        max_retries: int = 3,
+        max_wait: float = 10.0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+    ) -> None:
+        self.session: ClientSession = session
+        self.rate_limits: dict[str, tuple[float, int]] = rate_limits or {}
+        self.default_rate_limit: tuple[float, int] = default_rate_limit
+        self.max_retries: int = max_retries
+        self.max_wait: float = max_wait
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).hostname or ''
+
+        try:
+            return self._buckets[host]
+        except KeyError:
+            rate, capacity = self.rate_limits.get(host, self.default_rate_limit)
+            bucket = self._buckets[host] = TokenBucket(rate, capacity)
+            return bucket
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter", see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _sync_bucket(bucket: TokenBucket, response: ClientResponse) -> Optional[float]:
+        headers = response.headers
+        retry_after = _parse_seconds(headers.get('Retry-After'))
+
+        remaining = headers.get('RateLimit-Remaining') or headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.isdigit():
+            bucket.update(int(remaining), _parse_reset(headers) or retry_after or 1.0)
+
+        if response.status == 429:
+            bucket.block(retry_after if retry_after is not None else 1.0)
+
+        return retry_after
+
+    async def _wait(self, bucket: TokenBucket, url: str) -> None:
+        delay = bucket.reserve()
+
+        if delay > self.max_wait:
+            bucket.cancel()
+            raise UpstreamRateLimited(url, retry_after=delay)
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _prepare_body(kwargs: dict[str, Any]) -> int:
+        if 'json' in kwargs:
+            # Serialized here rather than by aiohttp, so that its size is known
+            headers = kwargs.get('headers') or {}
+            kwargs['data'] = json.dumps(kwargs.pop('json')).encode('utf-8')
+            kwargs['headers'] = {'Content-Type': 'application/json', **headers}
+
+        data = kwargs.get('data')
+        if isinstance(data, (bytes, bytearray, str)):
+            return len(data)
+
+        return getattr(data, 'size', None) or 0  # E.g. a MultipartWriter
+
+    async def _send(self, host: str, method: str, url: str, **kwargs) -> ClientResponse:
+        start = time.perf_counter()
+
+        try:
+            response = await self.session.request(method, url, **kwargs)
+        except Exception as exc:
+            UPSTREAM_ERRORS.labels(host, type(exc).__name__).inc()
+            raise
+
+        UPSTREAM_SECONDS.labels(host).observe(time.perf_counter() - start)
+        UPSTREAM_REQUESTS.labels(host, str(response.status)).inc()
+        return response
+
+    @asynccontextmanager
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        idempotent: Optional[bool] = None,
+        **kwargs,
+    ) -> AsyncIterator[ClientResponse]:
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+        retry_statuses = ALWAYS_RETRY_STATUSES | IDEMPOTENT_RETRY_STATUSES if idempotent else ALWAYS_RETRY_STATUSES
+        bucket = self.bucket(url)
+        host = urlsplit(url).hostname or ''
+        size = self._prepare_body(kwargs)
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait(bucket, url)
+            response = await self._send(host, method, url, **kwargs)
+            UPSTREAM_BYTES.labels(host, 'out').inc(size)
+            retry_after = self._sync_bucket(bucket, response)
+
+            if response.status in retry_statuses and attempt < self.max_retries:
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+
+                if delay <= self.max_wait:
+                    response.release()
+                    await asyncio.sleep(delay)
+                    continue
+
+            break
+
+        try:
+            yield response
+        finally:
+            UPSTREAM_BYTES.labels(host, 'in').inc(response.content.total_bytes)
+            response.release()
+
+    def get(self, url: str, **kwargs) -> AsyncIterator[ClientResponse]:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> AsyncIterator[ClientResponse]:
+        return self.request('POST', url, **kwargs)
+
+    @asynccontextmanager
+    async def ws_connect(self, url: str, **kwargs) -> AsyncIterator[ClientWebSocketResponse]:
+        """Opens a websocket, which counts as one request towards the host's rate limit."""
+        await self._wait(self.bucket(url), url)
+        host = urlsplit(url).hostname or ''
+
+        try:
+            ws = await self.session.ws_connect(url, **kwargs)
+        except Exception as exc:
+            UPSTREAM_ERRORS.labels(host, type(exc).__name__).inc()
+            raise
+
+        UPSTREAM_REQUESTS.labels(host, '101').inc()
+
+        async with ws:
+            yield ws
+
+
+class UpstreamRateLimited(Exception):
+    """Raised when an upstream host is rate limited for longer than we are willing to wait."""
+
+    def __init__(self, url: str, *, retry_after: float) -> None:
+        self.url: str = url
+        self.retry_after: float = retry_after
+
+        host = urlsplit(url).hostname
+        super().__init__(f'{host} is rate limiting us, please try again in {retry_after:.0f} seconds.')
+
+
+class ResponseTooLarge(Exception):
+    """Raised when a response body is larger than we are willing to read."""
+
+    def __init__(self, url: str, *, limit: int) -> None:
+        self.url: str = url
+        self.limit: int = limit
+
+        super().__init__(f'The output is too large, the limit is {limit / 1_000_000:g} MB.')
+
+
+async def read_limited(response: ClientResponse, limit: int) -> bytearray:
+    """Reads the body of a response, aborting as soon as it turns out to be larger than ``limit`` bytes."""
+    if response.content_length is not None and response.content_length > limit:
+        response.close()
+        raise ResponseTooLarge(str(response.url), limit=limit)
+
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+        body += chunk
+
+        if len(body) > limit:
+            # Closing rather than releasing drops the connection instead of draining the rest of the body
+            response.close()
+            raise ResponseTooLarge(str(response.url), limit=limit)
+
+    return body
@@ -0,0 +1,86 @@
+"""Just enough of a Rust lexer to tell whether a program has a top-level ``fn main``.
+
+Everything here runs in time linear to the size of the source: each pattern is searched from
+where the last one stopped, and none of them can backtrack past the token they match.
+"""
+
+from __future__ import annotations
+
+import re
+
+__all__ = (
+    'has_main',
+)
+
+# The rest of a character literal after its opening quote. Quotes this doesn't match start lifetimes or labels.
+_CHAR = r"(?:[^'\\\n]|\\(?:x[0-9a-fA-F]{2}|u\{[0-9a-fA-F_]{1,6}\}|.))'"
+
+# Anything which can hide a `fn main`, and `fn main` itself. Every alternative starts with a literal
+# so that the regex engine can skip straight to the characters which might start one.
+TOKEN_REGEX: re.Pattern[str] = re.compile(
+    r'//[^\n]*|/\*'
+    r'|"|b"|r#*"|br#*"'
+    r"|'" + _CHAR + r"|b'" + _CHAR +
+    r'|fn\s+main\s*\('
+)
+
+MAIN_REGEX: re.Pattern[str] = re.compile(r'fn\s+main\s*\(')
+
+BLOCK_COMMENT_REGEX: re.Pattern[str] = re.compile(r'/\*|\*/')
+
+# The rest of a string literal after its opening quote
+STRING_REGEX: re.Pattern[str] = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+
+def _skip_block_comment(code: str, pos: int) -> int:
+    depth = 1  # Block comments nest in Rust
+
+    while depth and (match := BLOCK_COMMENT_REGEX.search(code, pos)):
+        depth += 1 if match.group() == '/*' else -1
+        pos = match.end()
+
+    return pos if not depth else len(code)
+
+
+def _is_identifier_end(code: str, index: int) -> bool:
+    return index >= 0 and (code[index].isalnum() or code[index] == '_')
+
+
+def has_main(code: str) -> bool:
+    """Returns whether ``code`` defines ``fn main`` outside of any module, impl or other block.
+
+    Comments, strings, raw strings and character literals are skipped, so a ``fn main`` in them doesn't count.
+    """
+    if not MAIN_REGEX.search(code):
+        return False
+
+    pos = 0
+    depth = 0
+
+    while match := TOKEN_REGEX.search(code, pos):
+        start = match.start()
+        token = match.group()
+
+        # Braces between tokens can't be in a comment or literal, so they're counted in bulk
+        depth += code.count('{', pos, start) - code.count('}', pos, start)
+        pos = match.end()
+
+        if token[0] == 'f':
+            if depth <= 0 and not _is_identifier_end(code, start - 1):
+                return True
+        elif token == '/*':
+            pos = _skip_block_comment(code, pos)
+        elif token[-1] == '"':
+            if (prefix := token.lstrip('b'))[0] == 'r':
+                # Raw strings have no escapes, they end at a quote followed by as many hashes as they started with
+                if (end := code.find('"' + prefix[1:-1], pos)) == -1:
+                    break
+                pos = end + len(prefix) - 1
+            elif string := STRING_REGEX.match(code, pos):
+                pos = string.end()
+            else:
+                break
+
+        # Line comments and character literals are matched whole
+
+    return False
@@ -1,13 +1,18 @@
 from __future__ import annotations
 
 import aiohttp
+import hashlib
 import textwrap
 
 from rustpy.constants import URLs
+from rustpy.helpers.cache import LRUCache
+from rustpy.helpers.paste import PasteBackend
+from rustpy.helpers.singleflight import SingleFlight
 from typing import NamedTuple, Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from rustpy import RustPy
+    from rustpy.helpers.http import UpstreamHTTP
 
 __all__ = (
     'MystBinClient',
@@ -17,16 +22,41 @@ __all__ = (
 )
 
 
-class MystBinClient:
-    """Makes requests to https://mystb.in."""
+class MystBinClient(PasteBackend):
+    """Makes requests to https://mystb.in.
 
-    def __init__(self, *, bot: RustPy) -> None:
+    Fetched pastes are cached by their ID, and uploads are deduplicated by the hash of their
+    content for ``upload_ttl`` seconds, so that the same output doesn't get pasted over and over.
+    """
+
+    name = 'MystBin'
+
+    def __init__(
+        self,
+        *,
+        bot: RustPy,
+        paste_cache_size: int = 256,
+        paste_cache_ttl: float = 3600.0,
+        upload_cache_size: int = 1024,
+        upload_ttl: float = 3600.0,
+    ) -> None:
         self.bot: RustPy = bot
 
+        self.pastes: LRUCache[str, MystBinPaste] = LRUCache(paste_cache_size, ttl=paste_cache_ttl)
+        # Content hash and syntax -> ID of the paste it was uploaded as. Only IDs are kept, not the content.
+        self.uploads: LRUCache[str, str] = LRUCache(upload_cache_size, ttl=upload_ttl)
+
+        self._fetching: SingleFlight[MystBinPaste] = SingleFlight()
+        self._uploading: SingleFlight[str] = SingleFlight()
+
     @property
     def session(self) -> aiohttp.ClientSession:
         return self.bot.session
 
+    @property
+    def http(self) -> UpstreamHTTP:
+        return self.bot.upstream
+
     @staticmethod
     async def _raise_http_error(response: aiohttp.ClientResponse) -> None:
         fmt = f'{response.status} {response.reason}'
@@ -38,33 +68,57 @@ class MystBinClient:
 
         raise MystBinHTTPException(fmt)
 
-    async def get_paste(self, code: str) -> MystBinPaste:
-        async with self.session.get(
+    async def _fetch_paste(self, code: str) -> MystBinPaste:
+        async with self.http.get(
             URLs.MYSTBIN + '/' + code,
             timeout=aiohttp.ClientTimeout(15)
         ) as response:
             if response.status == 404:
-                raise MystBinPasteNotFound(code)
+                raise MystBinPasteNotFound(code=code)
 
             if not response.ok:
                 await self._raise_http_error(response)
 
             data = await response.json(encoding='utf-8')
 
-            return MystBinPaste(
-                content=textwrap.dedent(data['data']),
-                code=code,
-                syntax=data['syntax']
-            )
+        paste = MystBinPaste(
+            content=textwrap.dedent(data['data']),
+            code=code,
+            syntax=data['syntax']
+        )
+        self.pastes.set(code, paste)
+        return paste
+
+    async def get_paste(self, code: str) -> MystBinPaste:
+        if (paste := self.pastes.get(code)) is not None:
+            return paste
+
+        return await self._fetching.do(code, lambda: self._fetch_paste(code))
 
     async def create_paste(self, content: str, syntax: Optional[str] = None) -> MystBinPaste:
+        key = hashlib.sha256(content.encode('utf-8')).hexdigest() + '.' + (syntax or '')
+
+        if (code := self.uploads.get(key)) is None:
+            code = await self._uploading.do(key, lambda: self._upload(content, syntax, key=key))
+
+        return MystBinPaste(
+            content=content,
+            code=code,
+            syntax=syntax
+        )
+
+    async def upload(self, content: str, *, syntax: Optional[str] = None) -> str:
+        paste = await self.create_paste(content, syntax=syntax)
+        return paste.url
+
+    async def _upload(self, content: str, syntax: Optional[str], *, key: str) -> str:
         writer = aiohttp.MultipartWriter()
         writer.append(content).set_content_disposition('form-data', name='data')
 
         metadata = {"meta": [{"index": 0, "syntax": syntax}]}
         writer.append_json(metadata).set_content_disposition('form-data', name='meta')
 
-        async with self.session.post(
+        async with self.http.post(
             URLs.MYSTBIN,
             data=writer,
             timeout=aiohttp.ClientTimeout(15)
@@ -73,13 +127,11 @@ class MystBinClient:
                 await self._raise_http_error(response)
 
             data = await response.json(encoding='utf-8')
-            code = data['pastes'][0]['id']
 
-            return MystBinPaste(
-                content=content,
-                code=code,
-                syntax=syntax
-            )
+        # Cached here rather than by the caller, which may have stopped waiting if the paste service timed out
+        code = data['pastes'][0]['id']
+        self.uploads.set(key, code)
+        return code
 
 
 class MystBinPaste(NamedTuple):
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+from rustpy.constants import OFFLOAD_THRESHOLD, OFFLOAD_WORKERS
+from typing import Any, Callable, TypeVar
+
+__all__ = (
+    'Offloader',
+)
+
+T = TypeVar('T')
+
+
+class Offloader:
+    """Runs CPU heavy work on a small shared thread pool once its input is large enough to stall the event loop.
+
+    Work on inputs smaller than ``threshold`` bytes runs inline, handing it to a thread would cost more
+    than it saves. Work which holds the GIL, like decoding, still shares the interpreter with the loop,
+    but the loop gets it back every switch interval rather than waiting for the whole thing.
+    """
+
+    def __init__(self, *, threshold: int = OFFLOAD_THRESHOLD, workers: int = OFFLOAD_WORKERS) -> None:
+        self.threshold: int = threshold
+        self.workers: int = workers
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='offload')
+
+    def __repr__(self) -> str:
+        return f'<Offloader threshold={self.threshold} workers={self.workers}>'
+
+    async def run(self, func: Callable[..., T], *args: Any, size: int) -> T:
+        """Calls ``func`` with the given arguments, on the pool if ``size`` is at least the threshold."""
+        if size < self.threshold:
+            return func(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import time
+
+import aiohttp
+
+from rustpy.constants import URLs
+from rustpy.helpers.breaker import CircuitBreaker
+from typing import Iterable, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rustpy import RustPy
+    from rustpy.helpers.http import UpstreamHTTP
+
+__all__ = (
+    'PasteBackend',
+    'PasteRsClient',
+    'PasteService',
+    'PasteHTTPException',
+    'PasteUnavailable',
+)
+
+
+class PasteBackend(abc.ABC):
+    """A service long output can be uploaded to."""
+
+    name: str
+
+    @abc.abstractmethod
+    async def upload(self, content: str, *, syntax: Optional[str] = None) -> str:
+        """Uploads the content, returning the URL it can be viewed at."""
+        raise NotImplementedError
+
+
+class PasteRsClient(PasteBackend):
+    """Makes requests to https://paste.rs, or anything serving the same API such as the local stand-in."""
+
+    name = 'paste.rs'
+
+    def __init__(self, *, bot: RustPy, url: str = URLs.PASTE_RS, name: Optional[str] = None) -> None:
+        self.bot: RustPy = bot
+        self.url: str = url if url.endswith('/') else url + '/'
+
+        if name is not None:
+            self.name = name
+
+    def __repr__(self) -> str:
+        return f'<PasteRsClient name={self.name!r} url={self.url!r}>'
+
+    @property
+    def http(self) -> UpstreamHTTP:
+        return self.bot.upstream
+
+    async def upload(self, content: str, *, syntax: Optional[str] = None) -> str:
+        async with self.http.post(
+            self.url,
+            data=content.encode('utf-8'),
+            timeout=aiohttp.ClientTimeout(15),
+        ) as response:
+            # 206 means the paste was cut off because it was too large
+            if response.status != 201:
+                raise PasteHTTPException(self.name, f'{response.status} {response.reason}')
+
+            url = (await response.text(encoding='utf-8')).strip()
+
+        return url + '.' + syntax if syntax else url
+
+
+class _BackendState:
+    __slots__ = ('backend', 'breaker', 'latency')
+
+    def __init__(self, backend: PasteBackend) -> None:
+        self.backend: PasteBackend = backend
+        self.breaker: CircuitBreaker = CircuitBreaker(backend.name, min_requests=3)
+        self.latency: float = 0.0  # EWMA, in seconds. Backends which weren't used yet are tried first.
+
+    def __repr__(self) -> str:
+        return f'<PasteBackend name={self.backend.name!r} latency={self.latency:.3f} state={self.breaker.state.name}>'
+
+
+class PasteService:
+    """Uploads to the fastest healthy paste backend, failing over to the others in order of their latency.
+
+    Every attempt gets at most ``timeout`` seconds, so that one slow backend doesn't hold up the output.
+    """
+
+    def __init__(self, backends: Iterable[PasteBackend], *, timeout: float = 5.0, decay: float = 0.3) -> None:
+        self.timeout: float = timeout
+        self.decay: float = decay
+        self._states: list[_BackendState] = [_BackendState(backend) for backend in backends]
+
+        if not self._states:
+            raise ValueError('A paste service needs at least one backend.')
+
+    def __repr__(self) -> str:
+        return f'<PasteService backends={self._states!r}>'
+
+    @property
+    def backends(self) -> list[PasteBackend]:
+        return [state.backend for state in self._states]
+
+    def _ranked_states(self) -> list[_BackendState]:
+        return sorted((state for state in self._states if not state.breaker.is_open), key=lambda s: s.latency)
+
+    def ranked(self) -> list[PasteBackend]:
+        """The backends which are currently healthy, fastest first."""
+        return [state.backend for state in self._ranked_states()]
+
+    async def _attempt(self, state: _BackendState, content: str, syntax: Optional[str]) -> str:
+        start = time.perf_counter()
+
+        async with state.breaker.guard():
+            url = await asyncio.wait_for(state.backend.upload(content, syntax=syntax), timeout=self.timeout)
+
+        latency = time.perf_counter() - start
+        state.latency = latency if not state.latency else self.decay * latency + (1 - self.decay) * state.latency
+        return url
+
+    async def upload(self, content: str, *, syntax: Optional[str] = None) -> str:
+        errors = []
+
+        for state in self._ranked_states():
+            try:
+                return await self._attempt(state, content, syntax)
+            except Exception as exc:  # Whatever went wrong, the next backend might work
+                errors.append(exc)
+
+        raise PasteUnavailable(errors)
+
+
+class PasteHTTPException(Exception):
+    """Raised when an HTTP related error occurs while uploading to a paste backend."""
+
+    def __init__(self, name: str, reason: str) -> None:
+        self.name: str = name
+        super().__init__(f'Could not upload to {name}: {reason}')
+
+
+class PasteUnavailable(Exception):
+    """Raised when every paste backend failed or is unhealthy."""
+
+    def __init__(self, errors: list[Exception]) -> None:
+        self.errors: list[Exception] = errors
+        super().__init__('No paste service is available right now.')
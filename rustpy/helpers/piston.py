@@ -1,15 +1,31 @@
 from __future__ import annotations
 
-from rustpy.constants import URLs
-from typing import Iterable, NamedTuple, Optional, TYPE_CHECKING, TypedDict
+import aiohttp
+import asyncio
+import functools
+import json
+import os
+
+from rustpy.constants import BATCH_CONCURRENCY, MAX_RESPONSE_SIZE, URLs
+from rustpy.helpers.batch import gather_bounded
+from rustpy.helpers.breaker import CircuitBreaker
+from rustpy.helpers.cache import payload_hash
+from rustpy.helpers.catalog import Catalog
+from rustpy.helpers.fuzzy import FuzzyIndex
+from rustpy.helpers.http import ResponseTooLarge, read_limited
+from rustpy.helpers.pool import Backend, BackendPool, BalancingStrategy, NoBackendAvailable
+from rustpy.helpers.singleflight import SingleFlight
+from typing import Any, Callable, Iterable, NamedTuple, Optional, TYPE_CHECKING, TypedDict, Union
 
 if TYPE_CHECKING:
     from aiohttp import ClientResponse, ClientSession
     from rustpy import RustPy
+    from rustpy.helpers.http import UpstreamHTTP
 
 __all__ = (
     'PistonClient',
     'PistonRuntime',
+    'PistonRuntimeIndex',
     'PistonFile',
     'PistonOutput',
     'PistonResponse',
@@ -18,18 +34,50 @@ __all__ = (
     'PistonRuntimeNotFound',
 )
 
+# Handshake statuses meaning a backend doesn't have the websocket API at all
+STREAMING_UNSUPPORTED_STATUSES = frozenset({404, 405, 426})
+
 
 class PistonClient:
     """Makes requests to Piston API."""
 
-    def __init__(self, *, bot: RustPy) -> None:
+    def __init__(
+        self,
+        *,
+        bot: RustPy,
+        urls: Iterable[str] = (URLs.PISTON,),
+        strategy: BalancingStrategy = BalancingStrategy.LEAST_OUTSTANDING,
+        snapshot_directory: Optional[str] = None,
+        max_response_size: int = MAX_RESPONSE_SIZE,
+    ) -> None:
         self.bot: RustPy = bot
-        self._cached_runtimes: dict[str, PistonRuntime] = {}
+        self.max_response_size: int = max_response_size
+        self.pool: BackendPool = BackendPool(
+            urls,
+            strategy=strategy,
+            health_route='runtimes',
+            excluded=(PistonRuntimeNotFound, ResponseTooLarge),
+        )
+        self.catalog: Catalog[PistonRuntimeIndex] = Catalog(
+            'Piston runtimes',
+            http=lambda: self.http,
+            url=lambda: self.pool.pick().url + 'runtimes',
+            build=PistonRuntimeIndex.build,
+            snapshot_path=snapshot_directory and os.path.join(snapshot_directory, 'piston-runtimes.json'),
+        )
+        self._inflight: SingleFlight[PistonResponse] = SingleFlight()
+        self._streaming_unsupported: set[str] = set()
+        # Each backend has its own circuit breaker, this one only opens when none of them are available
+        self.breaker: CircuitBreaker = CircuitBreaker('Piston', failures=(NoBackendAvailable,))
 
     @property
     def session(self) -> ClientSession:
         return self.bot.session
 
+    @property
+    def http(self) -> UpstreamHTTP:
+        return self.bot.upstream
+
     @staticmethod
     async def _raise_http_error(response: ClientResponse) -> None:
         fmt = f'{response.status} {response.reason}'
@@ -39,36 +87,101 @@ class PistonClient:
         except aiohttp.ClientConnectionError:
             pass
 
-        raise PistonHTTPException(fmt)
+        raise PistonHTTPException(fmt, status=response.status)
 
     async def runtimes(self) -> dict[str, PistonRuntime]:
-        if len(self._cached_runtimes):
-            return self._cached_runtimes
-
-        async with self.session.get(URLs.PISTON + 'runtimes') as response:
-            if not response.ok:
-                await self._raise_http_error(response)
-
-            data = await response.json(encoding='utf-8')
-
-            self._cached_runtimes = res = {
-                entry['language']: PistonRuntime(**entry)
-                for entry in data
-            }
-            return res
+        index = await self.catalog.get()
+        return index.runtimes
 
     async def get_runtime(self, runtime: str, /) -> PistonRuntime:
         runtime = runtime.lower()
-        runtimes = await self.runtimes()
+        index = await self.catalog.get()
 
         try:
-            return runtimes[runtime]
+            return index.lookup[runtime]
         except KeyError:
-            for rt in runtimes.values():
-                if runtime in rt.aliases:
-                    return rt
+            pass
+
+        close_matches = list(dict.fromkeys(index.lookup[match].language for match in index.fuzzy.suggest(runtime)))
+        raise PistonRuntimeNotFound(f'Runtime {runtime!r} not found.', close_matches=close_matches)
+
+    async def _post_execute(
+        self,
+        url: str,
+        payload: dict[str, Any],
+        *,
+        runtime: PistonRuntime,
+        timeout: aiohttp.ClientTimeout,
+    ) -> PistonResponse:
+        async with self.http.post(url + 'execute', json=payload, timeout=timeout) as response:
+            if not response.ok and response.status != 400:  # 400's handled below
+                await self._raise_http_error(response)
+
+            raw = await read_limited(response, self.max_response_size)
+            data = await self.bot.offload.run(json.loads, raw, size=len(raw))
+
+            if response.status == 400:
+                raise PistonRuntimeNotFound(data['message'])
+
+            compile_output = PistonOutput(**data['compile']) if 'compile' in data else None
+
+            return PistonResponse(
+                runtime=runtime,
+                run_output=PistonOutput(**data['run']),
+                compile_output=compile_output,
+            )
+
+    async def _stream_execute(
+        self,
+        url: str,
+        payload: dict[str, Any],
+        *,
+        runtime: PistonRuntime,
+        on_output: Callable[[str], Any],
+    ) -> PistonResponse:
+        stages: dict[str, _StageOutput] = {}
+        stage = None
+
+        async with self.http.ws_connect(url + 'connect', max_msg_size=self.max_response_size) as ws:
+            await ws.send_json({'type': 'init', **payload})
+
+            if payload['input']:
+                await ws.send_json({'type': 'data', 'stream': 'stdin', 'data': payload['input']})
+
+            async for message in ws:
+                if message.type is not aiohttp.WSMsgType.TEXT:
+                    break
 
-        raise PistonRuntimeNotFound(f'Runtime {runtime!r} not found.')
+                event = message.json()
+
+                if event['type'] == 'stage':
+                    stage = stages[event['stage']] = _StageOutput()
+
+                elif event['type'] == 'data' and stage is not None:
+                    if stage.size + len(event['data']) > self.max_response_size:
+                        raise ResponseTooLarge(url, limit=self.max_response_size)
+
+                    stage.feed(event['stream'], event['data'])
+                    on_output(event['data'])
+
+                elif event['type'] == 'exit':
+                    stages.setdefault(event['stage'], _StageOutput()).exit(event['code'], event['signal'])
+
+                    if event['stage'] == 'run':
+                        break
+
+                elif event['type'] == 'error':
+                    raise PistonHTTPException(event['message'])
+
+        # Failed compiles end the job without a run stage
+        last_stage = stages.get('run') or stages.get('compile')
+        if last_stage is None or not last_stage.exited:
+            raise PistonHTTPException(f'The connection was closed before the job finished ({ws.close_code}).')
+
+        compile_output = stages['compile'].to_output() if 'compile' in stages else None
+        run_output = stages['run'].to_output() if 'run' in stages else PistonOutput('', '', '', None, None)
+
+        return PistonResponse(runtime=runtime, run_output=run_output, compile_output=compile_output)
 
     # noinspection PyShadowingBuiltins
     async def execute(
@@ -82,7 +195,14 @@ class PistonClient:
         run_timeout: float = 5.0,
         compile_memory_limit: int = -1,
         run_memory_limit: int = -1,
+        on_output: Optional[Callable[[str], Any]] = None,
     ) -> PistonResponse:
+        """Executes the given files with the given runtime.
+
+        If ``on_output`` is given, the job is run through Piston's websocket API and ``on_output``
+        is called with every chunk of output as it is printed. Backends which don't support
+        the websocket API run it like any other job instead.
+        """
         payload = {
             **runtime.to_json(),
             'files': [file.to_json() for file in files],
@@ -94,21 +214,85 @@ class PistonClient:
             'run_memory_limit': run_memory_limit,
         }
 
-        async with self.session.post(URLs.PISTON + 'execute', json=payload) as response:
-            if not response.ok and response.status != 400:  # 400's handled below
-                await self._raise_http_error(response)
+        # Give up shortly after Piston itself should have given up
+        timeout = compile_timeout + run_timeout + 10
+
+        async def on_backend(backend: Backend) -> PistonResponse:
+            if on_output is not None and backend.url not in self._streaming_unsupported:
+                try:
+                    return await asyncio.wait_for(
+                        self._stream_execute(backend.url, payload, runtime=runtime, on_output=on_output),
+                        timeout=timeout,
+                    )
+                except aiohttp.WSServerHandshakeError as exc:
+                    # Anything else may be temporary, so only this job falls back to a normal request
+                    if exc.status in STREAMING_UNSUPPORTED_STATUSES:
+                        self._streaming_unsupported.add(backend.url)
+
+            return await self._post_execute(
+                backend.url,
+                payload,
+                runtime=runtime,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            )
 
-            data = await response.json(encoding='utf-8')
-            if response.status == 400:
-                raise PistonRuntimeNotFound(data['message'])
+        async def execute() -> PistonResponse:
+            async with self.bot.scheduler.slot('piston'), self.breaker.guard():
+                return await self.pool.run(on_backend)
 
-            compile_output = PistonOutput(**data['compile']) if 'compile' in data else None
+        # Everyone streaming a job wants to see it live, so those aren't shared
+        if on_output is not None:
+            return await execute()
 
-            return PistonResponse(
-                runtime=runtime,
-                run_output=PistonOutput(**data['run']),
-                compile_output=compile_output,
-            )
+        return await self._inflight.do(payload_hash('execute', payload), execute)
+
+    async def execute_many(
+        self,
+        jobs: Iterable[tuple[PistonRuntime, Iterable[PistonFile]]],
+        *,
+        concurrency: int = BATCH_CONCURRENCY,
+        **kwargs: Any,
+    ) -> list[Union[PistonResponse, Exception]]:
+        """Executes many jobs concurrently, each given as the runtime and the files to run.
+
+        Results are in the same order as the jobs, a job which failed gives the exception it raised.
+        Other keyword arguments are passed to :meth:`execute` for every job.
+        """
+        return await gather_bounded(
+            (functools.partial(self.execute, runtime, files, **kwargs) for runtime, files in jobs),
+            limit=concurrency,
+        )
+
+
+class _StageOutput:
+    """Collects the output of a stage of a job streamed through the websocket API."""
+
+    __slots__ = ('chunks', 'size', 'code', 'signal', 'exited')
+
+    def __init__(self) -> None:
+        self.chunks: list[tuple[str, str]] = []
+        self.size: int = 0
+        self.code: Optional[int] = None
+        self.signal: Optional[str] = None
+        self.exited: bool = False
+
+    def feed(self, stream: str, data: str) -> None:
+        self.chunks.append((stream, data))
+        self.size += len(data)
+
+    def exit(self, code: Optional[int], signal: Optional[str]) -> None:
+        self.code = code
+        self.signal = signal
+        self.exited = True
+
+    def to_output(self) -> PistonOutput:
+        return PistonOutput(
+            stdout=''.join(data for stream, data in self.chunks if stream == 'stdout'),
+            stderr=''.join(data for stream, data in self.chunks if stream == 'stderr'),
+            output=''.join(data for _, data in self.chunks),
+            code=self.code,
+            signal=self.signal,
+        )
 
 
 class PistonRuntimeJSON(TypedDict):
@@ -132,6 +316,21 @@ class PistonRuntime(NamedTuple):
         }
 
 
+class PistonRuntimeIndex(NamedTuple):
+    runtimes: dict[str, PistonRuntime]  # By language
+    lookup: dict[str, PistonRuntime]  # By language and by alias
+    fuzzy: FuzzyIndex  # Of languages and aliases
+
+    @classmethod
+    def build(cls, data: list[dict[str, Any]]) -> PistonRuntimeIndex:
+        runtimes = {entry['language']: PistonRuntime(**entry) for entry in data}
+
+        lookup = {alias: rt for rt in runtimes.values() for alias in rt.aliases}
+        lookup.update(runtimes)  # Languages take precedence over aliases
+
+        return cls(runtimes, lookup, FuzzyIndex(lookup))
+
+
 class PistonFileJSON(TypedDict):
     name: str
     content: str
@@ -168,10 +367,7 @@ class PistonResponse(NamedTuple):
     compile_output: Optional[PistonOutput] = None
 
     def __str__(self) -> str:
-        if self.compile_output:
-            return f'{self.compile_output!s}\n{self.run_output!s}'
-
-        return str(self.run_output)
+        return ''.join(self.parts)
 
     def __repr__(self) -> str:
         return f'<PistonResponse runtime={self.runtime!r} ' \
@@ -188,6 +384,14 @@ class PistonResponse(NamedTuple):
     def output(self) -> str:
         return str(self)
 
+    @property
+    def parts(self) -> tuple[str, ...]:
+        """The pieces :attr:`output` is made of, for when it doesn't have to be joined."""
+        if self.compile_output:
+            return self.compile_output.output, '\n', self.run_output.output
+
+        return self.run_output.output,
+
 
 class PistonException(Exception):
     """Raised when an error related to Piston occurs."""
@@ -196,6 +400,14 @@ class PistonException(Exception):
 class PistonHTTPException(PistonException):
     """Raised when an error occurs when requesting to Piston."""
 
+    def __init__(self, message: str, *, status: Optional[int] = None) -> None:
+        self.status: Optional[int] = status  # Of the HTTP response, if the error came with one
+        super().__init__(message)
+
 
 class PistonRuntimeNotFound(PistonException):
     """Raised when a runtime is not found."""
+
+    def __init__(self, message: str, *, close_matches: list[str] = None) -> None:
+        self.close_matches: list[str] = close_matches or []
+        super().__init__(message)
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from contextlib import asynccontextmanager
+from enum import Enum
+
+import aiohttp
+
+from rustpy.helpers.breaker import CircuitBreaker
+from typing import AsyncIterator, Awaitable, Callable, Collection, Iterable, Optional, Type, TypeVar, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
+T = TypeVar('T')
+
+__all__ = (
+    'Backend',
+    'BackendPool',
+    'BalancingStrategy',
+    'NoBackendAvailable',
+)
+
+
+class BalancingStrategy(Enum):
+    LEAST_OUTSTANDING = 0  # Fewest requests in flight, ties broken by latency
+    EWMA_LATENCY      = 1  # Lowest expected latency, weighted by requests in flight
+
+
+class Backend:
+    """One endpoint of a :class:`BackendPool`."""
+
+    __slots__ = ('url', 'outstanding', 'latency', 'healthy', 'draining', 'breaker', 'cooldown_until', '_idle')
+
+    def __init__(self, url: str, *, excluded: tuple[Type[BaseException], ...] = ()) -> None:
+        self.url: str = url if url.endswith('/') else url + '/'
+        self.outstanding: int = 0
+        self.latency: float = 0.0  # EWMA, in seconds
+        self.healthy: bool = True
+        self.draining: bool = False
+        self.breaker: CircuitBreaker = CircuitBreaker(self.url, excluded=excluded)
+        self.cooldown_until: float = 0.0  # Monotonic time, it's skipped until then after failing to connect
+        self._idle: asyncio.Event = asyncio.Event()
+        self._idle.set()
+
+    def __repr__(self) -> str:
+        return (
+            f'<Backend url={self.url!r} outstanding={self.outstanding} latency={self.latency:.3f} '
+            f'healthy={self.healthy} draining={self.draining}>'
+        )
+
+    @property
+    def available(self) -> bool:
+        return (
+            self.healthy
+            and not self.draining
+            and not self.breaker.is_open
+            and time.monotonic() >= self.cooldown_until
+        )
+
+    def _record_latency(self, latency: float, *, decay: float) -> None:
+        self.latency = latency if not self.latency else decay * latency + (1 - decay) * self.latency
+
+
+class BackendPool:
+    """Balances requests between several endpoints serving the same API.
+
+    Endpoints are periodically health checked by requesting ``health_route`` on them, and can be
+    drained so that they finish their in-flight requests without receiving new ones.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        *,
+        strategy: BalancingStrategy = BalancingStrategy.LEAST_OUTSTANDING,
+        health_route: str = '',
+        health_interval: float = 30.0,
+        decay: float = 0.3,
+        connect_cooldown: float = 10.0,
+        excluded: tuple[Type[BaseException], ...] = (),
+    ) -> None:
+        self.strategy: BalancingStrategy = strategy
+        self.health_route: str = health_route
+        self.health_interval: float = health_interval
+        self.decay: float = decay
+        self.connect_cooldown: float = connect_cooldown
+        self.excluded: tuple[Type[BaseException], ...] = excluded
+
+        self.backends: dict[str, Backend] = {}
+        for url in urls:
+            self.add(url)
+
+        if not self.backends:
+            raise ValueError('A backend pool needs at least one backend.')
+
+        self._health_task: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return f'<BackendPool strategy={self.strategy.name} backends={list(self.backends.values())!r}>'
+
+    def add(self, url: str) -> Backend:
+        backend = Backend(url, excluded=self.excluded)
+        return self.backends.setdefault(backend.url, backend)
+
+    def _score(self, backend: Backend) -> tuple[float, float]:
+        if self.strategy is BalancingStrategy.EWMA_LATENCY:
+            return (backend.latency or 0.001) * (backend.outstanding + 1), backend.outstanding
+
+        return backend.outstanding, backend.latency
+
+    def _candidates(self, exclude: Collection[Backend]) -> list[Backend]:
+        return [backend for backend in self.backends.values() if backend.available and backend not in exclude]
+
+    def pick(self, *, exclude: Collection[Backend] = ()) -> Backend:
+        if not (candidates := self._candidates(exclude)):
+            raise NoBackendAvailable()
+
+        return min(candidates, key=self._score)
+
+    @asynccontextmanager
+    async def use(self, *, exclude: Collection[Backend] = ()) -> AsyncIterator[Backend]:
+        backend = self.pick(exclude=exclude)
+        backend.outstanding += 1
+        backend._idle.clear()
+
+        start = time.perf_counter()
+        try:
+            async with backend.breaker.guard():
+                yield backend
+        except aiohttp.ClientConnectorError:
+            # A lone backend has nowhere to fail over to, its circuit breaker takes care of it instead
+            if len(self.backends) > 1:
+                backend.cooldown_until = time.monotonic() + self.connect_cooldown
+            raise
+        else:
+            # Only successes count, otherwise a backend which fails fast would look like the quickest one
+            backend._record_latency(time.perf_counter() - start, decay=self.decay)
+        finally:
+            backend.outstanding -= 1
+
+            if not backend.outstanding:
+                backend._idle.set()
+
+    async def run(self, func: Callable[[Backend], Awaitable[T]]) -> T:
+        """Calls ``func`` with a backend, retrying on the next one as long as they can't be connected to.
+
+        Nothing was sent to a backend which couldn't be connected to, so retrying is always safe.
+        """
+        tried: list[Backend] = []
+
+        while True:
+            try:
+                async with self.use(exclude=tried) as backend:
+                    return await func(backend)
+            except aiohttp.ClientConnectorError:
+                tried.append(backend)
+                if not self._candidates(tried):
+                    raise
+
+    async def drain(self, url: str, *, remove: bool = False) -> None:
+        """Stops sending new requests to a backend and waits for its in-flight requests to finish."""
+        backend = self.backends[url if url.endswith('/') else url + '/']
+        backend.draining = True
+        await backend._idle.wait()
+
+        if remove:
+            del self.backends[backend.url]
+
+    def undrain(self, url: str) -> None:
+        self.backends[url if url.endswith('/') else url + '/'].draining = False
+
+    async def check_health(self, session: ClientSession) -> None:
+        async def check(backend: Backend) -> None:
+            try:
+                async with session.get(backend.url + self.health_route, timeout=aiohttp.ClientTimeout(10)) as response:
+                    backend.healthy = response.ok
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                backend.healthy = False
+
+        await asyncio.gather(*map(check, self.backends.values()))
+
+    async def _health_loop(self, session: ClientSession) -> None:
+        while True:
+            await self.check_health(session)
+            await asyncio.sleep(self.health_interval)
+
+    def start(self, session: ClientSession, *, loop: asyncio.AbstractEventLoop = None) -> None:
+        # A lone backend is never marked unhealthy, its circuit breaker takes care of it instead
+        if len(self.backends) > 1 and self._health_task is None:
+            loop = loop or asyncio.get_running_loop()
+            self._health_task = loop.create_task(self._health_loop(session))
+
+    def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+
+class NoBackendAvailable(Exception):
+    """Raised when every backend of a pool is unhealthy, draining or failing."""
+
+    def __init__(self) -> None:
+        super().__init__('No backend is available to handle this request right now, please try again in a bit.')
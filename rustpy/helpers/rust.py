@@ -1,16 +1,26 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+import json
 import re
 from dataclasses import dataclass
 
 import aiohttp
 
-from rustpy.constants import RustChannel, RustEdition, RustMode, URLs
-from typing import ClassVar, Literal, Type, TypeVar, TYPE_CHECKING
+from rustpy.constants import BATCH_CONCURRENCY, MAX_RESPONSE_SIZE, RustChannel, RustEdition, RustMode, URLs
+from rustpy.helpers.batch import gather_bounded
+from rustpy.helpers.breaker import CircuitBreaker
+from rustpy.helpers.cache import LRUCache, ResultCache, payload_hash
+from rustpy.helpers.http import ResponseTooLarge, read_limited
+from rustpy.helpers.lexer import has_main
+from rustpy.helpers.singleflight import SingleFlight
+from typing import Any, ClassVar, Iterable, Literal, Optional, Type, TypeVar, TYPE_CHECKING, Union
 
 if TYPE_CHECKING:
     from aiohttp import ClientResponse, ClientSession
     from rustpy import RustPy
+    from rustpy.helpers.http import UpstreamHTTP
     R = TypeVar('R')
 
 __all__ = (
@@ -23,18 +33,34 @@ __all__ = (
 class RustPlaygroundClient:
     """Makes requests to https://play.rust-lang.org"""
 
-    FN_MAIN_REGEX: ClassVar[re.Pattern[str]] = re.compile(
-        r'fn\s+main\s*\([^)]*\)\s*(->\s*[^{]+\s*)?{.*\}',
-        re.S
+    # Programs using any of these may print something different every run, so their output isn't cached
+    NONDETERMINISTIC_REGEX: ClassVar[re.Pattern[str]] = re.compile(
+        r'\b(rand|getrandom|SystemTime|Instant|RandomState|HashMap|HashSet|thread|env|process|ptr|unsafe|alloc)\b'
+        r'|\{:[#?]*p\}'
     )
 
-    def __init__(self, *, bot: RustPy) -> None:
+    def __init__(
+        self,
+        *,
+        bot: RustPy,
+        cache: Optional[ResultCache] = None,
+        max_response_size: int = MAX_RESPONSE_SIZE,
+    ) -> None:
         self.bot: RustPy = bot
+        self.cache: ResultCache = cache or ResultCache()
+        self.crate_types: LRUCache[str, str] = LRUCache(1024)  # SHA-256 of the code -> crate type
+        self.max_response_size: int = max_response_size
+        self._inflight: SingleFlight[Optional[dict[str, Any]]] = SingleFlight()
+        self.breaker: CircuitBreaker = CircuitBreaker('The Rust playground', excluded=(ResponseTooLarge,))
 
     @property
     def session(self) -> ClientSession:
         return self.bot.session
 
+    @property
+    def http(self) -> UpstreamHTTP:
+        return self.bot.upstream
+
     @staticmethod
     async def _raise_http_error(response: ClientResponse) -> None:
         fmt = f'{response.status} {response.reason}'
@@ -46,15 +72,58 @@ class RustPlaygroundClient:
 
         raise RustPlaygroundHTTPException(fmt)
 
-    async def _request(self, route: str, *, cls: Type[R] = None, **kwargs) -> R:
-        async with self.session.post(URLs.RUST_PLAYGROUND + route, **kwargs) as response:
-            if not response.ok:
-                await self._raise_http_error(response)
-
-            data = await response.json(encoding='utf-8')
-            cls = cls or RustPlaygroundResponse
+    async def _request(
+        self,
+        route: str,
+        payload: dict[str, Any],
+        *,
+        cls: Type[R] = None,
+        cacheable: bool = True,
+        timeout_response: R = None,
+        idempotent: bool = True,
+    ) -> R:
+        cls = cls or RustPlaygroundResponse
+        key = payload_hash(route, payload)
+
+        if cacheable and (data := await self.cache.get(key)) is not None:
             return cls(**data)
 
+        async def fetch() -> Optional[dict[str, Any]]:
+            async with self.bot.scheduler.slot('rust'), self.breaker.guard(), self.http.post(
+                URLs.RUST_PLAYGROUND + route,
+                json=payload,
+                idempotent=idempotent,
+                timeout=aiohttp.ClientTimeout(total=60),
+            ) as response:
+                if response.status == 500 and timeout_response is not None:
+                    return None
+
+                if not response.ok:
+                    await self._raise_http_error(response)
+
+                raw = await read_limited(response, self.max_response_size)
+
+            data = await self.bot.offload.run(json.loads, raw, size=len(raw))
+
+            if cacheable:
+                await self.cache.set(key, data)
+
+            return data
+
+        if (data := await self._inflight.do(key, fetch)) is None:
+            return timeout_response
+
+        return cls(**data)
+
+    async def _crate_type(self, code: str) -> str:
+        key = hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+        if (crate_type := self.crate_types.get(key)) is None:
+            crate_type = 'bin' if await self.bot.offload.run(has_main, code, size=len(code)) else 'lib'
+            self.crate_types.set(key, crate_type)
+
+        return crate_type
+
     async def execute(
         self,
         code: str,
@@ -67,25 +136,38 @@ class RustPlaygroundClient:
             'backtrace': False,
             'channel': channel.name.lower(),
             'code': code,
-            'crateType': 'bin' if self.FN_MAIN_REGEX.search(code) else 'lib',
+            'crateType': await self._crate_type(code),
             'edition': edition.name[1:],
             'mode': mode.name.lower(),
             'tests': False,
         }
 
-        async with self.session.post(URLs.RUST_PLAYGROUND + 'execute', json=payload) as response:
-            if response.status == 500:
-                return RustPlaygroundResponse(
-                    success=False,
-                    stdout='',
-                    stderr='Timed out.',
-                )
-
-            if not response.ok:
-                await self._raise_http_error(response)
+        return await self._request(
+            'execute',
+            payload,
+            cacheable=not self.NONDETERMINISTIC_REGEX.search(code),
+            idempotent=False,
+            timeout_response=RustPlaygroundResponse(
+                success=False,
+                stdout='',
+                stderr='Timed out.',
+            ),
+        )
+
+    async def execute_many(
+        self,
+        jobs: Iterable[dict[str, Any]],
+        *,
+        concurrency: int = BATCH_CONCURRENCY,
+    ) -> list[Union[RustPlaygroundResponse, Exception]]:
+        """Executes many programs concurrently, each job being the keyword arguments to :meth:`execute`.
 
-            data = await response.json(encoding='utf-8')
-            return RustPlaygroundResponse(**data)
+        Results are in the same order as the jobs, a job which failed gives the exception it raised.
+        """
+        return await gather_bounded(
+            (functools.partial(self.execute, **job) for job in jobs),
+            limit=concurrency,
+        )
 
     async def format(self, code: str, *, edition: RustEdition = RustEdition.E2018) -> RustFormatResponse:
         payload = {
@@ -93,16 +175,16 @@ class RustPlaygroundClient:
             'edition': edition.name[1:],
         }
 
-        return await self._request('format', cls=RustFormatResponse, json=payload)
+        return await self._request('format', payload, cls=RustFormatResponse)
 
     async def clippy(self, code: str, *, edition: RustEdition.E2018) -> RustPlaygroundResponse:
         payload = {
             'code': code,
-            'crateType': 'bin' if self.FN_MAIN_REGEX.search(code) else 'lib',
+            'crateType': await self._crate_type(code),
             'edition': edition.name[1:],
         }
 
-        return await self._request('clippy', json=payload)
+        return await self._request('clippy', payload)
 
     async def expand_macros(self, code: str, *, edition: RustEdition.E2018) -> RustPlaygroundResponse:
         payload = {
@@ -110,7 +192,7 @@ class RustPlaygroundClient:
             'edition': edition.name[1:],
         }
 
-        return await self._request('macro-expansion', json=payload)
+        return await self._request('macro-expansion', payload)
 
 
 @dataclass
@@ -120,10 +202,15 @@ class RustPlaygroundResponse:
     stderr: str
 
     def __str__(self) -> str:
+        return ''.join(self.parts)
+
+    @property
+    def parts(self) -> tuple[str, ...]:
+        """The pieces the string form of this response is made of, for when they don't have to be joined."""
         if self.success:
-            return self.stdout
+            return self.stdout,
 
-        return f'{self.stderr}\n{self.stdout}'
+        return self.stderr, '\n', self.stdout
 
     def __repr__(self) -> str:
         return f'<{self.__class__.__name__} success={self.success}>'
@@ -133,11 +220,12 @@ class RustPlaygroundResponse:
 class RustFormatResponse(RustPlaygroundResponse):
     code: str
 
-    def __str__(self) -> str:
+    @property
+    def parts(self) -> tuple[str, ...]:
         if not self.success:
-            return f'{self.stdout}\n{self.stderr}\n{self.code}'.strip('\n')
+            return f'{self.stdout}\n{self.stderr}\n{self.code}'.strip('\n'),
 
-        return self.code
+        return self.code,
 
 
 class RustPlaygroundHTTPException(Exception):
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from rustpy.core.metrics import QUEUE_WAIT_SECONDS
+from typing import AsyncIterator, Awaitable, Callable, Iterator, NamedTuple, Optional
+
+__all__ = (
+    'BackendQueue',
+    'ExecutionScheduler',
+    'SchedulerQueueFull',
+    'Submission',
+)
+
+QueuedCallback = Callable[[str, int], Awaitable[None]]
+
+# Seconds between checks of whether a queued request moved up, so that its position can be reported again
+POSITION_INTERVAL = 5.0
+
+
+class Submission(NamedTuple):
+    # The key requests are fairly queued by, usually a guild ID
+    guild_id: int = 0
+    on_queued: Optional[QueuedCallback] = None
+
+
+_submission: ContextVar[Submission] = ContextVar('submission', default=Submission())
+
+
+class BackendQueue:
+    """Caps the amount of concurrent requests to one backend.
+
+    Requests over the cap wait in per-guild queues which are served round-robin,
+    so that one busy guild can't starve every other one.
+    """
+
+    def __init__(self, name: str, *, concurrency: int, max_queued: int) -> None:
+        self.name: str = name
+        self.concurrency: int = concurrency
+        self.max_queued: int = max_queued
+
+        self._active: int = 0
+        self._queued: int = 0
+        self._queues: OrderedDict[int, deque[asyncio.Future[None]]] = OrderedDict()
+
+    def __repr__(self) -> str:
+        return f'<BackendQueue name={self.name!r} active={self._active} queued={self._queued}>'
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def position(self, waiter: asyncio.Future[None]) -> int:
+        """Returns the 1-indexed position the given waiter will be served at, or 0 if it isn't queued."""
+        queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+
+        for depth in range(max(map(len, queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    if queue[depth] is waiter:
+                        return position
+
+        return 0
+
+    def _wake_next(self) -> None:
+        while self._queues and self._active < self.concurrency:
+            guild_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+
+            if queue:
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+
+            if not waiter.done():
+                self._active += 1
+                waiter.set_result(None)
+
+    def _remove(self, guild_id: int, waiter: asyncio.Future[None]) -> None:
+        if (queue := self._queues.get(guild_id)) is None or waiter not in queue:
+            return
+
+        queue.remove(waiter)
+        self._queued -= 1
+
+        if not queue:
+            del self._queues[guild_id]
+
+    async def _wait_reporting(self, waiter: asyncio.Future[None], on_queued: QueuedCallback) -> None:
+        reported = 0
+
+        while not waiter.done():
+            if (position := self.position(waiter)) != reported:
+                reported = position
+                await on_queued(self.name, position)
+
+            await asyncio.wait((waiter,), timeout=POSITION_INTERVAL)
+
+    async def acquire(self, submission: Submission) -> None:
+        if self._active < self.concurrency and not self._queues:
+            self._active += 1
+            return
+
+        if self._queued >= self.max_queued:
+            raise SchedulerQueueFull(self.name)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(submission.guild_id, deque()).append(waiter)
+        self._queued += 1
+
+        try:
+            if submission.on_queued is None:
+                await waiter
+            else:
+                await self._wait_reporting(waiter, submission.on_queued)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # A slot was granted right before we were cancelled
+            else:
+                self._remove(submission.guild_id, waiter)
+            raise
+
+    def release(self) -> None:
+        self._active -= 1
+        self._wake_next()
+
+
+class ExecutionScheduler:
+    """Schedules every request made to code execution backends.
+
+    Each backend has its own :class:`BackendQueue`. Requests are attributed to the
+    :class:`Submission` set through :meth:`submission`, which is usually done by the command.
+    """
+
+    def __init__(self, limits: dict[str, int], *, max_queued: int = 32) -> None:
+        self.queues: dict[str, BackendQueue] = {
+            name: BackendQueue(name, concurrency=concurrency, max_queued=max_queued)
+            for name, concurrency in limits.items()
+        }
+
+    def __repr__(self) -> str:
+        return f'<ExecutionScheduler queues={list(self.queues.values())!r}>'
+
+    @staticmethod
+    @contextmanager
+    def submission(guild_id: int, *, on_queued: QueuedCallback = None) -> Iterator[Submission]:
+        token = _submission.set(submission := Submission(guild_id, on_queued))
+        try:
+            yield submission
+        finally:
+            _submission.reset(token)
+
+    @asynccontextmanager
+    async def slot(self, backend: str) -> AsyncIterator[None]:
+        queue = self.queues[backend]
+
+        with QUEUE_WAIT_SECONDS.labels(backend).time():
+            await queue.acquire(_submission.get())
+
+        try:
+            yield
+        finally:
+            queue.release()
+
+
+class SchedulerQueueFull(Exception):
+    """Raised when too many requests are already queued for a backend."""
+
+    def __init__(self, backend: str) -> None:
+        self.backend: str = backend
+        super().__init__(f'Too many requests are queued for {backend} right now, please try again in a bit.')
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+
+from typing import Awaitable, Callable, Generic, TypeVar
+
+__all__ = (
+    'SingleFlight',
+)
+
+T = TypeVar('T')
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls that share the same key into one upstream call.
+
+    The first caller of a key starts the call, every other caller waiting on that key while it is
+    still in flight receives the same result (or exception). Cancelling a waiter only cancels the wait,
+    never the shared call.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: dict[str, asyncio.Future[T]] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    def _done(self, key: str, future: asyncio.Future[T]) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+        # Every waiter might have been cancelled, mark the exception as retrieved
+        if not future.cancelled():
+            future.exception()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        try:
+            future = self._inflight[key]
+        except KeyError:
+            future = self._inflight[key] = asyncio.ensure_future(func())
+            future.add_done_callback(lambda f: self._done(key, f))
+
+        return await asyncio.shield(future)
@@ -1,16 +1,32 @@
 from __future__ import annotations
 
-from rustpy.constants import URLs
+import aiohttp
+import asyncio
+import codecs
+import os
+import time
+
+from functools import cached_property
+from rustpy.constants import MAX_OUTPUT_SIZE, URLs
+from rustpy.helpers.breaker import CircuitBreaker
+from rustpy.helpers.cache import payload_hash
+from rustpy.helpers.catalog import Catalog, CatalogUnavailable
+from rustpy.helpers.fuzzy import FuzzyIndex
+from rustpy.helpers.http import UpstreamRateLimited
+from rustpy.helpers.singleflight import SingleFlight
 from zlib import compress
 
-from typing import ClassVar, TYPE_CHECKING, Union
+from typing import Any, ClassVar, Iterable, NamedTuple, Optional, TYPE_CHECKING, Union
 
 if TYPE_CHECKING:
     from aiohttp import ClientSession
     from rustpy import RustPy
+    from rustpy.helpers.http import UpstreamHTTP
 
 __all__ = (
+    'DeflateTuner',
     'TIOClient',
+    'TIOLanguageIndex',
     'TIOResponse',
     'TIOException',
     'TIOHTTPException',
@@ -18,6 +34,49 @@ __all__ = (
 )
 
 
+class DeflateTuner:
+    """Compresses with the highest zlib level expected to take at most ``target`` seconds for the input size.
+
+    How long each level takes per byte is measured as payloads are compressed, so that the choice
+    follows the machine the bot runs on rather than guesses.
+    """
+
+    LEVELS: ClassVar[tuple[int, ...]] = (9, 6, 1)
+
+    # Rough seconds per byte of source code for each level, until they've been measured
+    DEFAULT_COSTS: ClassVar[dict[int, float]] = {9: 1 / 20e6, 6: 1 / 50e6, 1: 1 / 150e6}
+
+    # Inputs smaller than this are too quick to compress to time reliably
+    MIN_MEASURED_SIZE: ClassVar[int] = 16_384
+
+    def __init__(self, *, target: float = 0.02, decay: float = 0.2) -> None:
+        self.target: float = target
+        self.decay: float = decay
+        self.costs: dict[int, float] = dict(self.DEFAULT_COSTS)
+
+    def __repr__(self) -> str:
+        return f'<DeflateTuner target={self.target} costs={self.costs!r}>'
+
+    def level(self, size: int) -> int:
+        for level in self.LEVELS:
+            if size * self.costs[level] <= self.target:
+                return level
+
+        return self.LEVELS[-1]
+
+    def compress(self, data: bytes) -> bytes:
+        level = self.level(len(data))
+
+        start = time.perf_counter()
+        compressed = compress(data, level)
+
+        if len(data) >= self.MIN_MEASURED_SIZE:
+            cost = (time.perf_counter() - start) / len(data)
+            self.costs[level] = self.decay * cost + (1 - self.decay) * self.costs[level]
+
+        return compressed
+
+
 class TIOClient:
     """Makes requests to tio.run."""
 
@@ -55,40 +114,68 @@ class TIOClient:
         'hs': 'haskell',
     }
 
-    def __init__(self, *, bot: RustPy) -> None:
+    def __init__(
+        self,
+        *,
+        bot: RustPy,
+        snapshot_directory: Optional[str] = None,
+        max_output: int = MAX_OUTPUT_SIZE,
+    ) -> None:
         self.bot: RustPy = bot
-        self._cached_languages: list[str] = None
+        self.max_output: int = max_output
+        self.catalog: Catalog[TIOLanguageIndex] = Catalog(
+            'TIO languages',
+            http=lambda: self.http,
+            url=lambda: URLs.TIO_LANGUAGES,
+            build=TIOLanguageIndex.build,
+            snapshot_path=snapshot_directory and os.path.join(snapshot_directory, 'tio-languages.json'),
+        )
+        self._inflight: SingleFlight[TIOResponse] = SingleFlight()
+        self.breaker: CircuitBreaker = CircuitBreaker('TIO')
+        self.deflate: DeflateTuner = DeflateTuner()
 
     @property
     def session(self) -> ClientSession:
         return self.bot.session
 
-    async def languages(self) -> list[str]:
-        if self._cached_languages:
-            return self._cached_languages
-
-        async with self.session.get(URLs.TIO_LANGUAGES) as response:
-            if not response.ok:
-                return
+    @property
+    def http(self) -> UpstreamHTTP:
+        return self.bot.upstream
 
-            json = await response.json()
-            self._cached_languages = res = list(json.keys())
-            return res
+    async def languages(self) -> list[str]:
+        index = await self.catalog.get()
+        return index.names
 
     async def _get_language(self, language: str) -> str:
         language = language.lower()
+        index = await self.catalog.get()
 
-        if language not in await self.languages():
+        if language not in index.lookup:
             if lang := self.LANGUAGE_SHORTCUTS.get(language):
                 return lang
 
-            start = language[:3]
-            raise TIOLanguageUnavailable(language, close_matches=[
-                lang for lang in self._cached_languages if lang.startswith(start)
-            ][:10])
+            raise TIOLanguageUnavailable(language, close_matches=index.fuzzy.suggest(language))
         else:
             return language
 
+    async def find_language(self, candidates: Iterable[str]) -> Optional[str]:
+        """Returns the TIO language for the first of the given names that resolves to one, if any."""
+        try:
+            index = await self.catalog.get()
+        except (CatalogUnavailable, UpstreamRateLimited, asyncio.TimeoutError, aiohttp.ClientError):
+            return None  # TIO is unavailable too
+
+        for candidate in candidates:
+            candidate = candidate.lower()
+
+            if candidate in index.lookup:
+                return candidate
+
+            if lang := self.LANGUAGE_SHORTCUTS.get(candidate):
+                return lang
+
+        return None
+
     def _encode(self, key: str, value: Union[list[str], str] = None) -> bytes:
         if not value:
             return bytes()
@@ -106,17 +193,21 @@ class TIOClient:
         encoded = b''.join(
             map(self._encode, payload.keys(), payload.values())
         )
-        return compress(encoded + b'R', 9)[2:-4]
+        return self.deflate.compress(encoded + b'R')[2:-4]
+
+    async def request(self, payload: dict[str, Union[str, list[str]]], *, language: str) -> TIOResponse:
+        size = sum(len(value) if isinstance(value, str) else sum(map(len, value)) for value in payload.values())
+        payload = await self.bot.offload.run(self._compress_payload, payload, size=size)
 
-    async def request(self, payload: dict[str, Union[str, list[str]]]) -> str:
-        payload = self._compress_payload(payload)
+        # TIO kills programs after 60 seconds
+        timeout = aiohttp.ClientTimeout(total=75)
 
-        async with self.session.post(URLs.TIO_RUN, data=payload) as response:
+        async with self.bot.scheduler.slot('tio'), self.breaker.guard(), \
+                self.http.post(URLs.TIO_RUN, data=payload, timeout=timeout) as response:
             if not response.ok:
                 raise TIOHTTPException(f'{response.status}: {response.reason}')
 
-            data = await response.read()
-            return data.decode('utf-8')
+            return await TIOResponse.from_stream(response.content, language=language, max_output=self.max_output)
 
     # noinspection PyShadowingBuiltins
     async def run(
@@ -140,39 +231,177 @@ class TIOClient:
             'args': args or []
         }
 
-        return TIOResponse(await self.request(payload), language=language)
+        return await self._inflight.do(
+            payload_hash('run', payload),
+            lambda: self.request(payload, language=language),
+        )
+
+
+class TIOLanguageIndex(NamedTuple):
+    names: list[str]
+    lookup: frozenset[str]
+    fuzzy: FuzzyIndex
+
+    @classmethod
+    def build(cls, data: dict[str, Any]) -> TIOLanguageIndex:
+        names = list(data.keys())
+        return cls(names, frozenset(names), FuzzyIndex(names))
 
 
 class TIOResponse:
+    """The result of running a program on TIO.
+
+    Only the first ``max_output`` bytes of the program's output are kept, and the timings and
+    exit code are parsed out of the last few kilobytes of the response, so that memory use stays
+    the same however much the program prints. The output is only decoded when it is accessed.
+    """
+
+    TOKEN_SIZE: ClassVar[int] = 16
+
+    # Plenty for the trailer, i.e. the second token and the lines with the timings and exit code
+    TAIL_SIZE: ClassVar[int] = 4096
+
+    CHUNK_SIZE: ClassVar[int] = 64 * 1024
+
     real_time: float
     user_time: float
     sys_time: float
     cpu_share: float  # In percent
 
-    def __init__(self, raw: str, *, language: str) -> None:
+    def __init__(self, raw: Union[str, bytes], *, language: str, max_output: int = MAX_OUTPUT_SIZE) -> None:
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+
         self.language: str = language
-        self.token: str = raw[:16]
-        self.raw: str = raw[16:-16]
 
-        chunks = self.raw.split('\n')
+        separator = raw.find(b'\n' + raw[:self.TOKEN_SIZE], self.TOKEN_SIZE)
+        self._parse(
+            raw[:self.TOKEN_SIZE + max_output],
+            raw[-self.TAIL_SIZE:],
+            len(raw),
+            separator=separator if separator != -1 else None,
+        )
 
-        self.real_time, self.user_time, self.sys_time, self.cpu_share = [
-            self._parse_chunk(chunk) for chunk in chunks[-5:-1]
-        ]
+    @classmethod
+    async def from_stream(
+        cls,
+        stream: aiohttp.StreamReader,
+        *,
+        language: str,
+        max_output: int = MAX_OUTPUT_SIZE,
+    ) -> TIOResponse:
+        """Parses a response as it is read from the stream."""
+        head_size = cls.TOKEN_SIZE + max_output
+        head = bytearray()
+        tail = bytearray()
+        total = 0
+
+        # Where the output ends, found by searching for the token after it, with enough of the
+        # previous chunk carried over to find it across chunks
+        separator = None
+        carry = b''
+
+        async for chunk in stream.iter_chunked(cls.CHUNK_SIZE):
+            if (missing := head_size - len(head)) > 0:
+                head += chunk[:missing]
+
+            if separator is None:
+                window = carry + chunk
+                start = total - len(carry)
+
+                if len(head) < cls.TOKEN_SIZE:
+                    carry = window
+                elif (index := window.find(b'\n' + head[:cls.TOKEN_SIZE], max(cls.TOKEN_SIZE - start, 0))) != -1:
+                    separator = start + index
+                else:
+                    carry = window[-cls.TOKEN_SIZE:]
+
+            total += len(chunk)
+            tail += chunk[-cls.TAIL_SIZE:]
+            del tail[:-cls.TAIL_SIZE]
+
+        self = cls.__new__(cls)
+        self.language = language
+        self._parse(head, tail, total, separator=separator)
+        return self
+
+    def _parse(
+        self,
+        head: Union[bytes, bytearray],
+        tail: Union[bytes, bytearray],
+        total: int,
+        *,
+        separator: Optional[int] = None,
+    ) -> None:
+        # The response is laid out as <token><output>\n<token><debug>\nExit code: <code><token>,
+        # where the last lines of the debug section hold the timings
+        size = self.TOKEN_SIZE
+        self.token: str = bytes(head[:size]).decode('utf-8', 'replace')
+
+        body_end = max(total - size, size)
+        tail_start = total - len(tail)
+        body_tail = bytes(tail[max(size - tail_start, 0):body_end - tail_start])
+
+        lines = body_tail.rsplit(b'\n', 6)
+        if len(lines) == 7:
+            trailer = lines[1:]
+            output_end = body_end - len(body_tail) + len(lines[0])
+        elif tail_start <= size:
+            # The whole body is shorter than the trailer should be, so there's no output
+            trailer = lines
+            output_end = size
+        else:
+            # A line of the trailer is longer than the tail, the separator tells where the output ended
+            trailer = lines
+            output_end = tail_start
+
+        if separator is not None:
+            # Program errors are printed before the timings and can span lines, so the separator is more reliable
+            output_end = separator
+
+        timings = [self._parse_chunk(chunk) for chunk in trailer[-5:-1]]
+        self.real_time, self.user_time, self.sys_time, self.cpu_share = timings + [0.0] * (4 - len(timings))
 
         try:
-            self.exit_code: int = int(chunks[-1][11:])
-        except ValueError:
+            self.exit_code: int = int(trailer[-1][11:])
+        except (IndexError, ValueError):
             self.exit_code = 0
 
-        self.output: str = '\n'.join(chunks[:-6])
+        self._output: memoryview = memoryview(head)[size:max(min(len(head), output_end), size)]
+        self.output_size: int = max(output_end - size, 0)
+
+    @property
+    def truncated(self) -> bool:
+        return self.output_size > len(self._output)
+
+    def _decode(self, data: memoryview, *, final: bool) -> str:
+        # Truncation may cut a character in half, which shouldn't show up as a replacement character
+        return codecs.getincrementaldecoder('utf-8')('replace').decode(data, final=final)
+
+    @cached_property
+    def output(self) -> str:
+        output = self._decode(self._output, final=not self.truncated)
+
+        if self.truncated:
+            output += f'\n[... {self.output_size - len(self._output):,} more bytes truncated]'
+
+        return output
+
+    def preview(self, limit: int) -> str:
+        """Returns up to the first ``limit`` characters of the output, decoding no more than needed for them."""
+        # No character takes more than 4 bytes in UTF-8
+        data = self._output[:limit * 4]
+        return self._decode(data, final=len(data) == self.output_size)[:limit]
 
     @property
     def successful(self) -> bool:
         return self.exit_code == 0
 
-    def _parse_chunk(self, chunk: str, /) -> str:
-        return float(chunk[11:-2])
+    def _parse_chunk(self, chunk: bytes, /) -> float:
+        try:
+            return float(chunk[11:-2])
+        except ValueError:
+            return 0.0
 
     def __repr__(self) -> None:
         return f'<TIOResponse language={self.language!r} exit_code={self.exit_code}>'
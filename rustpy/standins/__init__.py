@@ -0,0 +1 @@
+"""Local stand-ins for the upstream services this bot talks to, for running it and testing it offline."""
@@ -0,0 +1,76 @@
+"""A local stand-in for paste.rs which keeps pastes on disk.
+
+Run it with ``python -m rustpy.standins.paste --port 2001`` and point the bot at it through
+``PASTE_BACKENDS=http://localhost:2001/``, optionally followed by the other backends to fail over to.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import re
+import secrets
+
+from aiohttp import web
+
+__all__ = (
+    'create_app',
+)
+
+PASTE_ID_REGEX: re.Pattern[str] = re.compile(r'(?P<id>[A-Za-z0-9]{8})(\.[A-Za-z0-9]+)?')
+
+
+def _write(path: str, data: bytes) -> None:
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def create_app(directory: str = '.cache/pastes', *, max_size: int = 4_000_000) -> web.Application:
+    """Creates an aiohttp application which stores pastes POSTed to ``/`` and serves them under ``/{id}``."""
+    os.makedirs(directory, exist_ok=True)
+
+    async def create(request: web.Request) -> web.Response:
+        data = await request.content.read(max_size + 1)
+
+        paste_id = secrets.token_urlsafe(6).replace('-', 'a').replace('_', 'b')
+        await asyncio.to_thread(_write, os.path.join(directory, paste_id), data[:max_size])
+
+        # Like paste.rs, a 206 means the paste was cut off
+        status = 206 if len(data) > max_size else 201
+        return web.Response(text=f'{request.url.origin()}/{paste_id}', status=status)
+
+    async def get(request: web.Request) -> web.Response:
+        if not (match := PASTE_ID_REGEX.fullmatch(request.match_info['paste'])):
+            raise web.HTTPNotFound()
+
+        try:
+            data = await asyncio.to_thread(_read, os.path.join(directory, match.group('id')))
+        except FileNotFoundError:
+            raise web.HTTPNotFound()
+
+        return web.Response(body=data, content_type='text/plain', charset='utf-8')
+
+    app = web.Application(client_max_size=max_size + 1024)
+    app.router.add_post('/', create)
+    app.router.add_get('/{paste}', get)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2001)
+    parser.add_argument('--directory', default='.cache/pastes')
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.directory), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""A local stand-in for the Piston API which runs code in subprocesses.
+
+This is *not* a sandbox. It exists so that the bot can be developed and tested offline,
+never point a public bot at it.
+
+Run it with ``python -m rustpy.standins.piston --port 2000`` and point the bot at it through
+``PISTON_URLS=http://localhost:2000/api/v2/piston/``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import codecs
+import os
+import shutil
+import signal
+import sys
+import tempfile
+
+from aiohttp import web
+from typing import Any, NamedTuple, Optional
+
+__all__ = (
+    'LocalRuntime',
+    'create_app',
+)
+
+
+class LocalRuntime(NamedTuple):
+    language: str
+    version: str
+    aliases: list[str]
+    command: list[str]  # The file to run is appended to this
+    extension: str
+
+
+def _default_runtimes() -> list[LocalRuntime]:
+    runtimes = [
+        LocalRuntime(
+            'python',
+            '.'.join(map(str, sys.version_info[:3])),
+            ['py', 'py3', 'python3'],
+            [sys.executable],
+            'py'
+        ),
+    ]
+
+    if shutil.which('bash'):
+        runtimes.append(LocalRuntime('bash', '5.0.0', ['sh'], ['bash'], 'sh'))
+
+    if shutil.which('node'):
+        runtimes.append(LocalRuntime('javascript', '16.0.0', ['node-javascript', 'node-js', 'js'], ['node'], 'js'))
+
+    return runtimes
+
+
+def _output(stdout: bytes, stderr: bytes, code: Optional[int], sig: Optional[str]) -> dict[str, Any]:
+    stdout = stdout.decode('utf-8', 'replace')
+    stderr = stderr.decode('utf-8', 'replace')
+
+    return {
+        'stdout': stdout,
+        'stderr': stderr,
+        'output': stdout + stderr,
+        'code': code,
+        'signal': sig,
+    }
+
+
+async def _spawn(runtime: LocalRuntime, data: dict[str, Any], directory: str) -> asyncio.subprocess.Process:
+    paths = []
+    for i, file in enumerate(data['files']):
+        name = os.path.basename(file.get('name') or f'file{i}.{runtime.extension}')
+        paths.append(path := os.path.join(directory, name))
+
+        with open(path, 'w', encoding='utf-8') as fp:
+            fp.write(file['content'])
+
+    return await asyncio.create_subprocess_exec(
+        *runtime.command,
+        paths[0],
+        *data.get('args', ()),
+        cwd=directory,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+
+def _exit_status(process: asyncio.subprocess.Process) -> tuple[Optional[int], Optional[str]]:
+    if process.returncode < 0:
+        return None, signal.Signals(-process.returncode).name
+
+    return process.returncode, None
+
+
+async def _run(runtime: LocalRuntime, data: dict[str, Any], *, max_output: int) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix='rustpy-piston-') as directory:
+        process = await _spawn(runtime, data, directory)
+
+        timeout = data.get('run_timeout', 3000) / 1000
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(data.get('input', '').encode('utf-8')),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            stdout, stderr = await process.communicate()
+
+        return _output(stdout[:max_output], stderr[:max_output], *_exit_status(process))
+
+
+async def _forward(reader: asyncio.StreamReader, stream: str, ws: web.WebSocketResponse, *, max_output: int) -> None:
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    sent = 0
+
+    while chunk := await reader.read(4096):
+        if sent < max_output and (text := decoder.decode(chunk[:max_output - sent])):
+            await ws.send_json({'type': 'data', 'stream': stream, 'data': text})
+
+        sent += len(chunk)  # Keep reading past the limit, so that the process doesn't block on a full pipe
+
+
+async def _stream(runtime: LocalRuntime, data: dict[str, Any], ws: web.WebSocketResponse, *, max_output: int) -> None:
+    with tempfile.TemporaryDirectory(prefix='rustpy-piston-') as directory:
+        await ws.send_json({'type': 'runtime', 'language': runtime.language, 'version': runtime.version})
+        await ws.send_json({'type': 'stage', 'stage': 'run'})
+
+        process = await _spawn(runtime, data, directory)
+
+        # The client also sends the input as a stdin data message, but like the POST route this takes it from init
+        try:
+            process.stdin.write(data.get('input', '').encode('utf-8'))
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The program exited without reading all of it
+        finally:
+            process.stdin.close()
+
+        forwarding = asyncio.gather(
+            _forward(process.stdout, 'stdout', ws, max_output=max_output),
+            _forward(process.stderr, 'stderr', ws, max_output=max_output),
+            process.wait(),
+        )
+
+        try:
+            await asyncio.wait_for(forwarding, timeout=data.get('run_timeout', 3000) / 1000)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+        code, sig = _exit_status(process)
+        await ws.send_json({'type': 'exit', 'stage': 'run', 'code': code, 'signal': sig})
+
+
+def create_app(
+    runtimes: list[LocalRuntime] = None,
+    *,
+    prefix: str = '/api/v2/piston',
+    max_output: int = 64_000,
+) -> web.Application:
+    """Creates an aiohttp application serving the ``runtimes``, ``execute`` and ``connect`` Piston routes."""
+    runtimes = runtimes or _default_runtimes()
+    lookup = {alias: rt for rt in runtimes for alias in (rt.language, *rt.aliases)}
+
+    async def get_runtimes(_: web.Request) -> web.Response:
+        return web.json_response([
+            {'language': rt.language, 'version': rt.version, 'aliases': rt.aliases}
+            for rt in runtimes
+        ])
+
+    async def execute(request: web.Request) -> web.Response:
+        data = await request.json()
+
+        if (runtime := lookup.get(data.get('language'))) is None:
+            return web.json_response({'message': f'{data.get("language")} is not a known runtime'}, status=400)
+
+        return web.json_response({
+            'language': runtime.language,
+            'version': runtime.version,
+            'run': await _run(runtime, data, max_output=max_output),
+        })
+
+    async def connect(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        message = await ws.receive_json(timeout=10)
+        if message.get('type') != 'init':
+            await ws.close(code=4003, message=b'Not yet initialised')
+            return ws
+
+        if (runtime := lookup.get(message.get('language'))) is None:
+            await ws.send_json({'type': 'error', 'message': f'{message.get("language")} is not a known runtime'})
+            await ws.close(code=4002, message=b'Notified Error')
+            return ws
+
+        await _stream(runtime, message, ws, max_output=max_output)
+        await ws.close(code=4999, message=b'Job Completed')
+        return ws
+
+    app = web.Application()
+    app['runtimes'] = runtimes
+    app.router.add_get(prefix + '/runtimes', get_runtimes)
+    app.router.add_post(prefix + '/execute', execute)
+    app.router.add_get(prefix + '/connect', connect)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2000)
+    args = parser.parse_args()
+
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from rustpy.helpers.tio import TIOResponse
+
+TOKEN = '0123456789abcdef'
+DEBUG = '\nReal time: 0.051 s\nUser time: 0.032 s\nSys. time: 0.011 s\nCPU share: 84.31 %\nExit code: 3'
+
+
+class FakeStream:
+    """Gives the data in chunks of its own size, like a network stream would."""
+
+    def __init__(self, data: bytes, chunk_size: int) -> None:
+        self.data: bytes = data
+        self.chunk_size: int = chunk_size
+
+    async def iter_chunked(self, _: int):
+        for i in range(0, len(self.data), self.chunk_size):
+            yield self.data[i:i + self.chunk_size]
+
+
+def make_response(output: str, stderr: str = '') -> str:
+    return TOKEN + output + '\n' + TOKEN + stderr + DEBUG + TOKEN
+
+
+def from_stream(raw: str, chunk_size: int) -> TIOResponse:
+    stream = FakeStream(raw.encode('utf-8'), chunk_size)
+    return asyncio.run(TIOResponse.from_stream(stream, language='python3'))
+
+
+@pytest.mark.parametrize(
+    'output', ['', 'Hello, world!', 'line\n' * 1000, 'x' * 10_000], ids=['empty', 'short', 'lines', 'long-line'],
+)
+@pytest.mark.parametrize(
+    'stderr', ['', 'E' * 5000, 'Traceback\n  File "main.py"\nError\n' * 300], ids=['none', 'long-line', 'lines'],
+)
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096, 64 * 1024])
+def test_output_ends_at_separator(output: str, stderr: str, chunk_size: int) -> None:
+    raw = make_response(output, stderr)
+
+    for response in (TIOResponse(raw, language='python3'), from_stream(raw, chunk_size)):
+        assert response.output == output
+        assert response.exit_code == 3
+        assert response.real_time == 0.051
+        assert response.cpu_share == 84.31